@@ -0,0 +1,141 @@
+import os
+import time
+import random
+import asyncio
+import aerofs
+from aiohttp import web
+
+CHUNK_SIZE = 256 * 1024
+
+
+class FakeDropbox:
+    """Serves local files the way Dropbox serves shared links:
+    `/s/<token>/<name>?dl=1` redirects to a content URL that honours Range
+    and sends an ETag, while `dl=0` returns an HTML preview page.
+
+    `bandwidth` caps each connection (bytes/s, 0 = unlimited) and
+    `fail_rate` answers that share of Range requests with a 503, like the
+    throttling Dropbox applies to many parallel range requests.
+    `max_connections` answers Range requests beyond that many in flight
+    with a 429 (0 = no limit)."""
+
+    def __init__(self, host="127.0.0.1", port=0, bandwidth=0, fail_rate=0.0, max_connections=0, seed=0):
+        self.host = host
+        self.port = port
+        self.bandwidth = bandwidth
+        self.fail_rate = fail_rate
+        self.max_connections = max_connections
+        self.active = 0
+        self.peak_active = 0
+        self.files = {}
+        self.requests = 0
+        self.failures = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._runner = None
+
+    def add(self, path):
+        token = f"bench{len(self.files):04d}"
+        self.files[token] = path
+        return f"http://{self.host}:{self.port}/s/{token}/{os.path.basename(path)}?dl=1"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/s/{token}/{name}", self._shared)
+        app.router.add_route("*", "/content/{token}/{name}", self._content)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        if not self.port:
+            self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _shared(self, request):
+        token = request.match_info["token"]
+        if token not in self.files:
+            raise web.HTTPNotFound()
+        if request.query.get("dl") != "1":
+            return web.Response(text="<html><body>Dropbox preview</body></html>", content_type="text/html")
+        raise web.HTTPFound(f"/content/{token}/{request.match_info['name']}")
+
+    def _parse_range(self, header, size):
+        unit, _, spec = header.partition("=")
+        if unit.strip() != "bytes" or "," in spec:
+            return None
+        start, _, end = spec.strip().partition("-")
+        if not start:
+            length = int(end)
+            return max(0, size - length), size - 1
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+        if start >= size or start > end:
+            return None
+        return start, end
+
+    async def _content(self, request):
+        path = self.files.get(request.match_info["token"])
+        if path is None:
+            raise web.HTTPNotFound()
+        self.requests += 1
+
+        stat = os.stat(path)
+        size = stat.st_size
+        headers = {
+            "Accept-Ranges": "bytes",
+            "ETag": f'"{stat.st_mtime_ns:x}-{size:x}"',
+            "Content-Type": "application/zip",
+            "Content-Disposition": f'attachment; filename="{os.path.basename(path)}"',
+        }
+
+        start, end, status = 0, size - 1, 200
+        if "Range" in request.headers:
+            if self.fail_rate and self._random.random() < self.fail_rate:
+                self.failures += 1
+                raise web.HTTPServiceUnavailable()
+            if self.max_connections and self.active >= self.max_connections:
+                self.throttled += 1
+                raise web.HTTPTooManyRequests(headers={"Retry-After": "1"})
+            parsed = self._parse_range(request.headers["Range"], size)
+            if parsed is None:
+                raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{size}"})
+            start, end = parsed
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        if request.method == "HEAD":
+            return response
+
+        sent = 0
+        began = time.monotonic()
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        try:
+            async with aerofs.open(path, "rb") as f:
+                await f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = await f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    if self.bandwidth:
+                        # Pace before writing, so the request stops counting
+                        # as active as soon as its last byte is out
+                        ahead = sent / self.bandwidth - (time.monotonic() - began)
+                        if ahead > 0:
+                            await asyncio.sleep(ahead)
+                    await response.write(chunk)
+                    remaining -= len(chunk)
+                    sent += len(chunk)
+        finally:
+            self.active -= 1
+        await response.write_eof()
+        return response
@@ -0,0 +1,93 @@
+import time
+import random
+import asyncio
+import itertools
+from types import SimpleNamespace
+from pyrogram.errors import FloodWait
+
+READ_SIZE = 1024 * 1024
+_message_ids = itertools.count(1)
+
+
+class FakeMessage:
+    def __init__(self, chat_id, media_type=None, client=None):
+        self.id = next(_message_ids)
+        self.chat = SimpleNamespace(id=chat_id)
+        self.edits = []
+        self._client = client
+        if media_type:
+            setattr(self, media_type, SimpleNamespace(file_id=f"bench-{media_type}-{self.id}"))
+
+    async def edit_text(self, text, **kwargs):
+        self.edits.append((time.monotonic(), text))
+        if self._client is not None:
+            self._client.edits += 1
+        return self
+
+
+def _read_all(media):
+    # Pyrogram reads every byte it uploads, so the stub does too
+    total = 0
+    if isinstance(media, str):
+        with open(media, "rb") as f:
+            while chunk := f.read(READ_SIZE):
+                total += len(chunk)
+        return total
+    media.seek(0)
+    while chunk := media.read(READ_SIZE):
+        total += len(chunk)
+    return total
+
+
+class FakeTelegram:
+    """Stands in for a Pyrogram Client on the upload side. Every send reads
+    the whole file, waits `latency` plus size / `bandwidth` (bytes/s, 0 =
+    unlimited) and is recorded in `calls`. A `flood_rate` share of calls
+    raises FloodWait(`flood_seconds`) before anything is sent."""
+
+    def __init__(self, name="backup_bot", latency=0.05, bandwidth=0, flood_rate=0.0, flood_seconds=1, seed=0):
+        self.name = name
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.calls = []
+        self.floods = 0
+        self.edits = 0
+        self._random = random.Random(seed)
+
+    async def _send(self, method, chat_id, media_items, media_type):
+        if self.flood_rate and self._random.random() < self.flood_rate:
+            self.floods += 1
+            raise FloodWait(value=self.flood_seconds)
+        started = time.monotonic()
+        size = 0
+        for media in media_items:
+            size += await asyncio.to_thread(_read_all, media)
+        delay = self.latency + (size / self.bandwidth if self.bandwidth else 0)
+        await asyncio.sleep(max(0, delay - (time.monotonic() - started)))
+        self.calls.append((method, len(media_items), size, time.monotonic() - started))
+        return [FakeMessage(chat_id, media_type, self) for _ in media_items]
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return FakeMessage(chat_id, client=self)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        return (await self._send("send_document", chat_id, [document], "document"))[0]
+
+    async def send_video(self, chat_id, video, **kwargs):
+        return (await self._send("send_video", chat_id, [video], "video"))[0]
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        return (await self._send("send_photo", chat_id, [photo], "photo"))[0]
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        return await self._send("send_media_group", chat_id, [item.media for item in media], "photo")
+
+    async def send_cached_media(self, chat_id, file_id, **kwargs):
+        # Nothing is read or uploaded, but the call still costs latency and can flood
+        await self._send("send_cached_media", chat_id, [], None)
+        return FakeMessage(chat_id, "document", self)
+
+    def uploaded_bytes(self):
+        return sum(call[2] for call in self.calls)
@@ -0,0 +1,337 @@
+"""Offline throughput benchmarks for the download, extract, image, upload and
+end-to-end paths. Everything runs locally: a synthetic archive is served by a
+fake Dropbox and uploads go to a stub Telegram client.
+
+    python -m benchmarks.run --preset smoke
+    python -m benchmarks.run --preset small --save baseline.json
+    python -m benchmarks.run --preset small --compare baseline.json
+
+--compare exits with status 1 when any stage is slower than the baseline by
+more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# config.py reads these at import time. The per-chat upload limit would
+# otherwise dominate every run, and dedup would skip repeated uploads.
+BENCH_ENV = {
+    "UPLOAD_RATE_PER_MINUTE": "1000000",
+    "DEDUP_MODE": "off",
+    "DISK_RESERVE_MB": "0",
+    "STATUS_INTERVAL": "1",
+    "METRICS_PORT": "0",
+}
+for _key, _value in BENCH_ENV.items():
+    os.environ.setdefault(_key, _value)
+
+from benchmarks.synthetic import PRESETS, generate_archive
+from benchmarks.fake_dropbox import FakeDropbox
+from benchmarks.fake_telegram import FakeTelegram
+
+STAGES = ["download", "stream", "extract", "images", "upload", "pipeline", "reuse"]
+MODES = ["stream", "disk", "inplace"]
+ALL_MEDIA = {"photos", "videos", "gifs", "documents", "other"}
+MB = 1024 * 1024
+
+
+def _result(seconds, size, files):
+    return {
+        "seconds": round(seconds, 3),
+        "bytes": size,
+        "files": files,
+        "mb_s": round(size / MB / seconds, 2) if seconds > 0 else 0,
+        "files_s": round(files / seconds, 2) if seconds > 0 else 0,
+    }
+
+
+def _walk(path):
+    return [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+
+
+async def bench_download(url, workdir):
+    from utils.downloader import SmartDownloader
+
+    dest = os.path.join(workdir, "download.zip")
+    downloader = SmartDownloader(url, dest)
+    started = time.perf_counter()
+    await downloader.download()
+    seconds = time.perf_counter() - started
+    size = os.path.getsize(dest)
+    os.remove(dest)
+    return _result(seconds, size, 1)
+
+
+async def bench_stream(url, workdir):
+    from utils.downloader import SmartDownloader
+    from utils.zip_stream import ZipStreamExtractor
+
+    out = os.path.join(workdir, "streamed")
+    extractor = ZipStreamExtractor(out)
+    downloader = SmartDownloader(url, os.path.join(workdir, "unused.zip"))
+    started = time.perf_counter()
+    await downloader.download_stream(extractor)
+    seconds = time.perf_counter() - started
+    size = sum(written for _, written in extractor.checksums.values())
+    shutil.rmtree(out, ignore_errors=True)
+    return _result(seconds, size, len(extractor.checksums))
+
+
+async def bench_extract(zip_path, out):
+    from utils.zip_helper import extract_zip, list_zip_members
+
+    files = []
+
+    async def on_file(path):
+        files.append(path)
+
+    started = time.perf_counter()
+    await extract_zip(zip_path, out, file_callback=on_file)
+    seconds = time.perf_counter() - started
+    size = sum(info.file_size for info in list_zip_members(zip_path))
+    return _result(seconds, size, len(files))
+
+
+async def bench_images(extracted, limit):
+    from config import IMAGE_WORKERS
+    from utils.image_processor import prepare_photo
+
+    photos = [
+        path for path in _walk(extracted)
+        if os.path.splitext(path)[1].lower() in (".jpg", ".jpeg", ".heic")
+    ][:limit]
+    slots = asyncio.Semaphore(IMAGE_WORKERS * 2)
+    outputs = []
+
+    async def convert(path):
+        async with slots:
+            outputs.append(await prepare_photo(path))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(convert(path) for path in photos))
+    seconds = time.perf_counter() - started
+    for output, source in zip(outputs, photos):
+        if output and output != source and os.path.exists(output):
+            os.remove(output)
+    return _result(seconds, sum(os.path.getsize(path) for path in photos), len(photos))
+
+
+async def bench_upload(extracted, telegram):
+    from config import UPLOAD_WORKERS
+    from utils.uploader import upload_limiter
+    from utils.client_pool import client_pool
+
+    pending = iter(_walk(extracted))
+    chat_id = -1
+
+    async def worker():
+        for path in pending:
+            size = os.path.getsize(path)
+            await upload_limiter.send(
+                chat_id, size,
+                lambda: client_pool.send(
+                    telegram, size, lambda session: session.send_document(chat_id=chat_id, document=path)
+                ),
+                os.path.basename(path),
+            )
+
+    calls = len(telegram.calls)
+    uploaded = telegram.uploaded_bytes()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(UPLOAD_WORKERS)))
+    seconds = time.perf_counter() - started
+    return _result(seconds, telegram.uploaded_bytes() - uploaded, len(telegram.calls) - calls)
+
+
+async def bench_pipeline(mode, url, archive_bytes, telegram):
+    import plugins.dropbox_handler as handler
+    from utils.tracer import TRACES_DIR, load_trace, summarize
+
+    shutil.rmtree("jobs", ignore_errors=True)
+    shutil.rmtree(TRACES_DIR, ignore_errors=True)
+    handler.EXTRACT_MODE = mode
+    status_msg = await telegram.send_message(-1, "bench")
+
+    calls = len(telegram.calls)
+    started = time.perf_counter()
+    await handler.process_download(telegram, status_msg, url, -1, set(ALL_MEDIA), 0)
+    seconds = time.perf_counter() - started
+
+    # Every call sends at least one message; a cached resend carries no media
+    result = _result(seconds, archive_bytes, sum(max(call[1], 1) for call in telegram.calls[calls:]))
+    result["status_edits"] = len(status_msg.edits)
+    result["final_status"] = status_msg.edits[-1][1] if status_msg.edits else ""
+    traces = _walk(TRACES_DIR) if os.path.isdir(TRACES_DIR) else []
+    if traces:
+        result["spans"] = {
+            name: {"count": total["count"], "busy": round(total["duration"], 3), "bytes": total["bytes"]}
+            for name, total in summarize(load_trace(traces[0])).items()
+            if name != "job"
+        }
+    return result
+
+
+async def bench_reuse(url, archive_bytes, telegram):
+    """A second backup of the same archive with DEDUP_MODE=resend: every
+    member goes out again by file_id through send_cached_media."""
+    import plugins.dropbox_handler as handler
+
+    previous = handler.DEDUP_MODE
+    handler.DEDUP_MODE = "resend"
+    try:
+        await bench_pipeline("disk", url, archive_bytes, telegram)
+        calls = len(telegram.calls)
+        result = await bench_pipeline("disk", url, archive_bytes, telegram)
+    finally:
+        handler.DEDUP_MODE = previous
+    result["reused"] = sum(1 for call in telegram.calls[calls:] if call[0] == "send_cached_media")
+    return result
+
+
+def _prepare_archive(args, workdir):
+    params = dict(PRESETS[args.preset])
+    path = os.path.join(workdir, f"{args.preset}.zip")
+    summary_path = f"{path}.json"
+    if args.regenerate or not os.path.exists(path) or not os.path.exists(summary_path):
+        print(f"Generating {args.preset} archive in {path}...")
+        started = time.perf_counter()
+        summary = generate_archive(path, **params)
+        with open(summary_path, "w") as f:
+            json.dump(summary, f)
+        print(f"Generated in {time.perf_counter() - started:.1f}s")
+    with open(summary_path) as f:
+        return path, json.load(f)
+
+
+def _print_results(results):
+    print()
+    print(f"{'stage':<22}{'seconds':>10}{'MB/s':>10}{'files/s':>10}")
+    for stage, result in results.items():
+        print(f"{stage:<22}{result['seconds']:>10.2f}{result['mb_s']:>10.2f}{result['files_s']:>10.2f}")
+        for name, span in sorted(result.get("spans", {}).items(), key=lambda item: -item[1]["busy"]):
+            rate = span["bytes"] / MB / span["busy"] if span["busy"] > 0 else 0
+            print(f"    {name:<18}{span['busy']:>10.2f}{rate:>10.2f}{span['count'] / span['busy'] if span['busy'] > 0 else 0:>10.2f}")
+        if "status_edits" in result:
+            print(f"    status edits: {result['status_edits']}")
+        if "reused" in result:
+            print(f"    resent by file_id: {result['reused']}")
+
+
+def _compare(results, baseline, tolerance):
+    """Stages whose MB/s or files/s fell more than `tolerance` below baseline."""
+    regressions = []
+    for stage, result in results.items():
+        before = baseline.get(stage)
+        if not before:
+            continue
+        for metric in ("mb_s", "files_s"):
+            if before[metric] and result[metric] < before[metric] * (1 - tolerance):
+                regressions.append(f"{stage} {metric}: {before[metric]} -> {result[metric]}")
+    return regressions
+
+
+async def main(args):
+    workdir = os.path.abspath(args.workdir)
+    os.makedirs(workdir, exist_ok=True)
+    zip_path, summary = _prepare_archive(args, workdir)
+    print(f"Archive: {summary['archive_bytes'] / MB:.1f} MB, {summary['photos']} JPEG, {summary['heic']} HEIC, "
+          f"{summary['videos']} videos, {summary['docs']} documents")
+
+    # Job directories, traces and the dedup database land in the workdir
+    rundir = os.path.join(workdir, "run")
+    shutil.rmtree(rundir, ignore_errors=True)
+    os.makedirs(rundir)
+    os.chdir(rundir)
+
+    dropbox = await FakeDropbox(
+        bandwidth=args.dropbox_bandwidth * MB, fail_rate=args.dropbox_fail_rate,
+        max_connections=args.dropbox_max_connections,
+    ).start()
+    url = dropbox.add(zip_path)
+    telegram = FakeTelegram(
+        latency=args.tg_latency, bandwidth=args.tg_bandwidth * MB,
+        flood_rate=args.flood_rate, flood_seconds=args.flood_seconds,
+    )
+
+    stages = args.stages.split(",")
+    results = {}
+    extracted = os.path.join(rundir, "extracted")
+    try:
+        if "download" in stages:
+            results["download"] = await bench_download(url, rundir)
+        if "stream" in stages:
+            results["stream_extract"] = await bench_stream(url, rundir)
+        if {"extract", "images", "upload"} & set(stages):
+            result = await bench_extract(zip_path, extracted)
+            if "extract" in stages:
+                results["extract"] = result
+        if "images" in stages:
+            results["images"] = await bench_images(extracted, args.image_limit)
+        if "upload" in stages:
+            results["upload"] = await bench_upload(extracted, telegram)
+        shutil.rmtree(extracted, ignore_errors=True)
+        if "pipeline" in stages:
+            for mode in args.modes.split(","):
+                results[f"pipeline_{mode}"] = await bench_pipeline(mode, url, summary["archive_bytes"], telegram)
+        if "reuse" in stages:
+            results["pipeline_reuse"] = await bench_reuse(url, summary["archive_bytes"], telegram)
+    finally:
+        await dropbox.stop()
+
+    _print_results(results)
+    print(f"\nDropbox requests: {dropbox.requests} ({dropbox.failures} failed on purpose, "
+          f"{dropbox.throttled} throttled, peak {dropbox.peak_active} in flight), "
+          f"Telegram calls: {len(telegram.calls)}, FloodWaits: {telegram.floods}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = _compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\n❌ Regressions:\n" + "\n".join(f"  {line}" for line in regressions))
+            return 1
+        print("\n✅ No regressions against the baseline")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "dropbox_bot_bench"),
+                        help="where archives are cached and jobs run")
+    parser.add_argument("--regenerate", action="store_true", help="rebuild the cached archive")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"comma separated subset of {','.join(STAGES)}")
+    parser.add_argument("--modes", default=",".join(MODES), help="EXTRACT_MODE values for the pipeline stage")
+    parser.add_argument("--image-limit", type=int, default=200, help="photos converted by the images stage")
+    parser.add_argument("--dropbox-bandwidth", type=float, default=0, help="MB/s per connection, 0 = unlimited")
+    parser.add_argument("--dropbox-fail-rate", type=float, default=0.0, help="share of range requests answered 503")
+    parser.add_argument("--dropbox-max-connections", type=int, default=0,
+                        help="parallel range requests before answering 429, 0 = no limit")
+    parser.add_argument("--tg-latency", type=float, default=0.05, help="seconds per Telegram call")
+    parser.add_argument("--tg-bandwidth", type=float, default=0, help="upload MB/s per call, 0 = unlimited")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of Telegram calls raising FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--save", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --save")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args(argv)
+    # The run changes into the workdir, so pin user paths first
+    args.save = os.path.abspath(args.save) if args.save else None
+    args.compare = os.path.abspath(args.compare) if args.compare else None
+    return args
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,120 @@
+import io
+import os
+import random
+import struct
+import zipfile
+from PIL import Image, ImageFilter
+
+# Distinct base images per format; each archive member is a base image with
+# a unique tag, so generating thousands of photos stays cheap. HEIC encoding
+# takes seconds per image, hence fewer bases.
+BASE_VARIANTS = 8
+HEIC_VARIANTS = 2
+BLOCK_SIZE = 16 * 1024 * 1024
+
+PRESETS = {
+    # A quick run for CI or before a commit
+    "smoke": {"photos": 100, "heic": 10, "videos": 1, "video_mb": 32, "docs": 5, "photo_size": (1600, 1200)},
+    # The default: big enough that per-file overhead and MB/s both show
+    "small": {"photos": 1000, "heic": 100, "videos": 2, "video_mb": 256, "docs": 20, "photo_size": (4032, 3024)},
+    # Close to a real camera-roll export; needs ~10 GB of disk
+    "realistic": {"photos": 5000, "heic": 500, "videos": 3, "video_mb": 2500, "docs": 50, "photo_size": (4032, 3024)},
+}
+
+
+def _base_image(size, seed):
+    # A smooth gradient with sensor-like noise compresses like a real photo
+    rng = random.Random(seed)
+    gradient = Image.linear_gradient("L").resize(size).rotate(rng.randint(0, 359))
+    channels = [
+        gradient,
+        Image.effect_noise(size, rng.randint(20, 60)),
+        gradient.filter(ImageFilter.GaussianBlur(rng.randint(1, 5))),
+    ]
+    rng.shuffle(channels)
+    return Image.merge("RGB", channels)
+
+
+def _jpeg_variants(size, count):
+    variants = []
+    for seed in range(count):
+        buf = io.BytesIO()
+        _base_image(size, seed).save(buf, "JPEG", quality=90)
+        variants.append(buf.getvalue())
+    return variants
+
+
+def _heic_variants(size, count):
+    try:
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+    except ImportError:
+        return []
+    variants = []
+    for seed in range(count):
+        buf = io.BytesIO()
+        try:
+            _base_image(size, seed).save(buf, "HEIF", quality=80)
+        except Exception as e:
+            print(f"⚠️ HEIC encoding unavailable ({e}), skipping HEIC members")
+            return []
+        variants.append(buf.getvalue())
+    return variants
+
+
+def _unique_jpeg(data, index):
+    # A COM segment right after SOI makes every member's content distinct
+    comment = f"bench-{index}".encode()
+    return data[:2] + b"\xff\xfe" + struct.pack(">H", len(comment) + 2) + comment + data[2:]
+
+
+def _write_large(zf, name, size, block):
+    info = zipfile.ZipInfo(name)
+    info.compress_type = zipfile.ZIP_STORED
+    with zf.open(info, "w", force_zip64=True) as out:
+        written = 0
+        while written < size:
+            chunk = block[:min(len(block), size - written)]
+            out.write(chunk)
+            written += len(chunk)
+
+
+def generate_archive(path, photos=1000, heic=100, videos=2, video_mb=256, docs=20, photo_size=(4032, 3024)):
+    """Write a Dropbox-style ZIP export and return a summary of its members.
+    Media is stored (it is already compressed), documents are deflated."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    jpegs = _jpeg_variants(photo_size, BASE_VARIANTS)
+    heics = _heic_variants(photo_size, HEIC_VARIANTS) if heic else []
+    block = os.urandom(BLOCK_SIZE)
+    summary = {"photos": 0, "heic": 0, "videos": 0, "docs": 0, "bytes": 0}
+
+    with zipfile.ZipFile(path, "w", allowZip64=True) as zf:
+        for index in range(photos):
+            data = _unique_jpeg(jpegs[index % len(jpegs)], index)
+            zf.writestr(zipfile.ZipInfo(f"Camera Roll/{2015 + index % 10}/IMG_{index:05d}.jpg"), data)
+            summary["photos"] += 1
+            summary["bytes"] += len(data)
+
+        for index in range(heic if heics else 0):
+            # HEIC has no COM segment; a trailing pad keeps contents distinct
+            data = heics[index % len(heics)] + index.to_bytes(4, "big")
+            zf.writestr(zipfile.ZipInfo(f"Camera Roll/HEIC/IMG_{index:05d}.heic"), data)
+            summary["heic"] += 1
+            summary["bytes"] += len(data)
+
+        for index in range(videos):
+            size = video_mb * 1024 * 1024
+            _write_large(zf, f"Videos/VID_{index:03d}.mp4", size, block)
+            summary["videos"] += 1
+            summary["bytes"] += size
+
+        for index in range(docs):
+            text = (f"Document {index}\n" + "Lorem ipsum dolor sit amet. " * 4000).encode()
+            zf.writestr(f"Documents/doc_{index:03d}.pdf", text, compress_type=zipfile.ZIP_DEFLATED)
+            summary["docs"] += 1
+            summary["bytes"] += len(text)
+
+        zf.writestr("manifest.json", "{}")
+
+    summary["archive_bytes"] = os.path.getsize(path)
+    return summary
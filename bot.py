@@ -1,7 +1,8 @@
 import logging
 import uvloop
-from pyrogram import Client
-from config import API_ID, API_HASH, BOT_TOKEN
+from pyrogram import Client, idle
+from config import API_ID, API_HASH, BOT_TOKEN, HELPER_BOT_TOKENS, UPLOAD_WORKERS
+from utils.client_pool import client_pool
 
 uvloop.install()
 
@@ -13,9 +14,49 @@ app = Client(
     api_id=API_ID,
     api_hash=API_HASH,
     bot_token=BOT_TOKEN,
+    max_concurrent_transmissions=UPLOAD_WORKERS,
     plugins=dict(root="plugins")
 )
 
+# Upload-only sessions; they must be admins of the dump channel
+helpers = [
+    Client(
+        f"helper_bot_{i}",
+        api_id=API_ID,
+        api_hash=API_HASH,
+        bot_token=token,
+        no_updates=True,
+        max_concurrent_transmissions=UPLOAD_WORKERS,
+    )
+    for i, token in enumerate(HELPER_BOT_TOKENS, start=1)
+]
+for helper in helpers:
+    client_pool.add_helper(helper)
+
+async def main():
+    from plugins.dropbox_handler import resume_jobs
+    from utils.scheduler import job_scheduler
+    from utils.system_stats import stats_sampler
+    from utils.metrics import start_metrics_server, stop_metrics_server
+
+    for client in [app] + helpers:
+        await client.start()
+    if helpers:
+        print(f"Using {len(helpers)} helper session(s) for uploads")
+
+    stats_sampler.start()
+    await start_metrics_server()
+
+    # Jobs interrupted by a crash or redeploy continue from their journal
+    await resume_jobs(app)
+    await idle()
+
+    await job_scheduler.shutdown()
+    await stats_sampler.stop()
+    await stop_metrics_server()
+    for client in [app] + helpers:
+        await client.stop()
+
 if __name__ == "__main__":
     print("Bot starting...")
-    app.run()
+    app.loop.run_until_complete(main())
@@ -11,5 +11,67 @@ OWNER_ID = int(os.getenv("OWNER_ID", "0"))
 DROPBOX_APP_KEY = os.getenv("DROPBOX_APP_KEY", "")
 DROPBOX_APP_SECRET = os.getenv("DROPBOX_APP_SECRET", "")
 DROPBOX_REFRESH_TOKEN = os.getenv("DROPBOX_REFRESH_TOKEN", "")
+# Concurrent per-file downloads when a job lists the link through the API
+DROPBOX_API_WORKERS = int(os.getenv("DROPBOX_API_WORKERS", "4"))
 
 DUMP_CHAT_ID = int(os.getenv("DUMP_CHAT_ID", "0"))
+
+# "disk" downloads the archive first, "stream" extracts entries while it
+# downloads, "inplace" downloads first and uploads non-photo members straight
+# out of the ZIP
+EXTRACT_MODE = os.getenv("EXTRACT_MODE", "disk").lower()
+
+# Processes used to extract large archives; 0 means one per CPU core
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "0")) or os.cpu_count() or 1
+
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+# Telegram allows bots roughly 20 messages per minute into one group/channel
+UPLOAD_RATE_PER_MINUTE = int(os.getenv("UPLOAD_RATE_PER_MINUTE", "20"))
+UPLOAD_MAX_INFLIGHT_MB = int(os.getenv("UPLOAD_MAX_INFLIGHT_MB", "4096"))
+
+# Extra bot tokens (comma separated) used only to spread upload traffic
+HELPER_BOT_TOKENS = [token.strip() for token in os.getenv("HELPER_BOT_TOKENS", "").split(",") if token.strip()]
+
+# Processes used for photo conversion; 0 means one per CPU core
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "0")) or os.cpu_count() or 1
+
+# Concurrent x265 encodes for segmented video transcoding and the segment length
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", "0")) or max(1, (os.cpu_count() or 1) // 4)
+TRANSCODE_SEGMENT_SECONDS = int(os.getenv("TRANSCODE_SEGMENT_SECONDS", "60"))
+
+# Oversize videos: "transcode" re-encodes them to fit, "split" cuts them
+# losslessly into parts. Oversize non-video files are always split.
+OVERSIZE_MODE = os.getenv("OVERSIZE_MODE", "transcode").lower()
+
+# Files whose content (ZIP CRC32 + size) was already uploaded to the dump chat:
+# "off" uploads them again, "skip" leaves them out, "resend" forwards the
+# stored file_id
+DEDUP_MODE = os.getenv("DEDUP_MODE", "off").lower()
+DEDUP_DB = os.getenv("DEDUP_DB", "dedup.sqlite3")
+
+# Backup jobs running at once; further links wait in the queue (/queue, /cancel)
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "1"))
+# Budgets shared by all running jobs: archives/folders downloading at once and
+# files uploading at once (video encodes use TRANSCODE_WORKERS)
+DOWNLOAD_SLOTS = int(os.getenv("DOWNLOAD_SLOTS", "1"))
+UPLOAD_SLOTS = int(os.getenv("UPLOAD_SLOTS", str(UPLOAD_WORKERS)))
+
+# Ranged download connections: where a host without history starts, the most
+# the tuner may open, and where the counts that worked per host are kept
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "4"))
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "16"))
+DOWNLOAD_TUNING_FILE = os.getenv("DOWNLOAD_TUNING_FILE", "download_tuning.json")
+
+# Space always left free on the volume when admitting a job
+DISK_RESERVE_MB = int(os.getenv("DISK_RESERVE_MB", "1024"))
+
+# Minimum seconds between edits of a job's status message
+STATUS_INTERVAL = float(os.getenv("STATUS_INTERVAL", "4"))
+
+# Seconds between system stats samples and how many samples are kept
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", "2"))
+STATS_HISTORY = int(os.getenv("STATS_HISTORY", "300"))
+
+# Prometheus-style /metrics endpoint; 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
@@ -1,223 +1,43 @@
 import os
-import shutil
 import time
+import zipfile
 import aiohttp
 from pyrogram import Client, filters
 from pyrogram.types import Message, InputMediaPhoto, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from pyrogram.errors import FloodWait
 import asyncio
-from config import DUMP_CHAT_ID, OWNER_ID
+from config import DUMP_CHAT_ID, OWNER_ID, EXTRACT_MODE, UPLOAD_WORKERS, IMAGE_WORKERS, OVERSIZE_MODE, DEDUP_MODE, DROPBOX_API_WORKERS
 from utils.aerofs_helper import write_stream_to_file
-from utils.zip_helper import extract_zip
+from utils.zip_helper import extract_zip, extract_member, list_zip_members, ZipMemberReader, central_directory_span, list_members_from_tail
+from utils.pipeline import Pipeline
+from utils.zip_stream import ZipStreamExtractor, safe_member_path
 from utils.progress import Progress
+from utils.status_reporter import StatusReporter
+from utils.tracer import JobTrace, current_trace, live_trace_path, span
 from utils.session_manager import session_manager
-from PIL import Image, ImageOps
-import pillow_heif
-
-pillow_heif.register_heif_opener()
+from utils.job_journal import journal_store, job_key
+from utils.dedup_cache import dedup_cache, content_key, dropbox_content_key
+from utils.dropbox_api import api_configured, list_shared_link, download_shared_file
+from utils.scheduler import job_scheduler
+from utils.disk_guard import disk_guard, estimate_peak
+from utils.uploader import upload_limiter
+from utils.client_pool import client_pool
+from utils.image_processor import prepare_photo
+from utils.video_processor import compress_video_h265, MAX_TELEGRAM_SIZE
+from utils.splitter import split_file, split_video, write_manifest
 
 VIDEO_FORMATS = ['.mp4', '.mov', '.avi', '.mkv', '.flv', '.wmv', '.webm', '.m4v', '.3gp', '.ts', '.mpg', '.mpeg', '.m2ts', '.mts']
 IMAGE_FORMATS = ['.jpg', '.jpeg', '.png', '.webp', '.tiff', '.tif', '.bmp', '.gif']
 HEIF_FORMATS = ['.heic', '.heif']
 GIF_FORMATS = ['.gif']
 DOCUMENT_FORMATS = ['.pdf', '.doc', '.docx', '.txt', '.zip', '.rar', '.7z']
-MAX_TELEGRAM_SIZE = 1.95 * 1024 * 1024 * 1024
-IMAGE_QUALITY = 85
-VIDEO_CRF_H265 = 24
-
-async def compress_image(input_path: str, output_path: str, max_quality: int = IMAGE_QUALITY) -> bool:
-    try:
-        img = Image.open(input_path)
-        exif_data = img.info.get('exif', None)
-        
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = background
-        
-        file_size = os.path.getsize(input_path)
-        
-        if file_size < 500 * 1024:
-            img.save(output_path, 'PNG', optimize=True)
-        else:
-            save_params = {
-                'format': 'JPEG',
-                'quality': max_quality,
-                'optimize': True,
-                'progressive': True,
-                'subsampling': 0,
-            }
-            if exif_data:
-                save_params['exif'] = exif_data
-            img.save(output_path, **save_params)
-        
-        if os.path.exists(output_path):
-            original_size = os.path.getsize(input_path)
-            compressed_size = os.path.getsize(output_path)
-            if compressed_size >= original_size * 0.95:
-                shutil.copy2(input_path, output_path)
-            return True
-        return False
-    except Exception as e:
-        print(f"Image compression error: {e}")
-        try:
-            shutil.copy2(input_path, output_path)
-            return True
-        except:
-            return False
-
-async def convert_heic_to_jpeg(input_path: str, output_path: str, quality: int = 95) -> bool:
-    try:
-        img = Image.open(input_path)
-        exif_data = img.info.get('exif', None)
-
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = background
-        else:
-            img = img.convert('RGB')
-
-        save_params = {
-            'format': 'JPEG',
-            'quality': quality,
-            'optimize': True,
-            'progressive': True,
-            'subsampling': 0,
-        }
-        if exif_data:
-            save_params['exif'] = exif_data
-        img.save(output_path, **save_params)
-        return os.path.exists(output_path)
-    except Exception as e:
-        print(f"HEIC convert error: {e}")
-        return False
-
-async def ensure_valid_photo_dimensions(input_path: str) -> str:
-    try:
-        img = Image.open(input_path)
-        try:
-            img = ImageOps.exif_transpose(img)
-        except Exception:
-            pass
-
-        width, height = img.size
-        if width <= 0 or height <= 0:
-            return input_path
-
-        MAX_SIDE = 10000
-        MAX_PIXELS = 40_000_000
-        scale = 1.0
-
-        if width > MAX_SIDE or height > MAX_SIDE:
-            scale = min(scale, MAX_SIDE / float(max(width, height)))
-
-        if width * height > MAX_PIXELS:
-            pixel_scale = (MAX_PIXELS / float(width * height)) ** 0.5
-            if pixel_scale < scale:
-                scale = pixel_scale
-
-        if scale >= 1.0:
-            return input_path
-
-        new_width = max(1, int(width * scale))
-        new_height = max(1, int(height * scale))
-        img = img.resize((new_width, new_height), Image.LANCZOS)
-
-        base, _ = os.path.splitext(input_path)
-        output_path = f"{base}_tgfixed.jpg"
-
-        exif_data = img.info.get('exif', None)
-        save_params = {
-            'format': 'JPEG',
-            'quality': 95,
-            'optimize': True,
-            'progressive': True,
-            'subsampling': 0,
-        }
-        if exif_data:
-            save_params['exif'] = exif_data
-        img.save(output_path, **save_params)
-
-        if os.path.exists(output_path):
-            return output_path
-        return input_path
-    except Exception as e:
-        print(f"Photo dimension fix error: {e}")
-        return input_path
-
-async def compress_video_h265(input_path: str, output_path: str, status_msg: Message = None) -> bool:
-    try:
-        if status_msg:
-            await status_msg.edit_text(f"🎬 Compressing video with H.265/HEVC (Near-Lossless Quality)...")
-        
-        cmd = [
-            "ffmpeg", "-i", input_path,
-            "-c:v", "libx265",
-            "-crf", str(VIDEO_CRF_H265),
-            "-preset", "medium",
-            "-pix_fmt", "yuv420p",
-            "-tag:v", "hvc1",
-            "-c:a", "aac",
-            "-b:a", "128k",
-            "-movflags", "+faststart",
-            "-y",
-            output_path
-        ]
-        
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        stdout, stderr = await proc.communicate()
-        
-        if proc.returncode == 0 and os.path.exists(output_path):
-            output_size = os.path.getsize(output_path)
-            original_size = os.path.getsize(input_path)
-            
-            if output_size < original_size and output_size < MAX_TELEGRAM_SIZE:
-                if status_msg:
-                    reduction = (1 - output_size / original_size) * 100
-                    await status_msg.edit_text(
-                        f"✅ Video compressed successfully!\n"
-                        f"📉 Size reduced by {reduction:.1f}%\n"
-                        f"Original: {original_size / (1024*1024*1024):.2f} GB\n"
-                        f"Compressed: {output_size / (1024*1024*1024):.2f} GB"
-                    )
-                return True
-            else:
-                if output_size >= MAX_TELEGRAM_SIZE:
-                    if status_msg:
-                        await status_msg.edit_text(f"🔄 File still too large, trying higher compression...")
-                    cmd[7] = "28"
-                    proc2 = await asyncio.create_subprocess_exec(
-                        *cmd,
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.PIPE
-                    )
-                    await proc2.wait()
-                    if proc2.returncode == 0 and os.path.exists(output_path):
-                        output_size2 = os.path.getsize(output_path)
-                        if output_size2 < MAX_TELEGRAM_SIZE:
-                            return True
-                return False
-        else:
-            print(f"FFmpeg failed: {stderr.decode() if stderr else 'Unknown error'}")
-            return False
-    except Exception as e:
-        print(f"Video compression error: {e}")
-        return False
 
 def get_main_menu_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    session = session_manager.get_session(user_id)
+    source = "Dropbox API (selected files)" if session and session['source'] == 'api' else "ZIP (whole folder)"
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("📂 Select Media Types", callback_data=f"media_menu:{user_id}")],
         [InlineKeyboardButton("📤 Select Dump Channel", callback_data=f"channel_menu:{user_id}")],
+        [InlineKeyboardButton(f"🔀 Source: {source}", callback_data=f"source_toggle:{user_id}")],
         [InlineKeyboardButton("⚙️ Settings Summary", callback_data=f"settings:{user_id}")],
         [InlineKeyboardButton("✅ Start Download", callback_data=f"download_start:{user_id}")]
     ])
@@ -364,6 +184,30 @@ async def media_toggle_callback(client: Client, callback: CallbackQuery):
     status = "enabled" if new_state else "disabled"
     await callback.answer(f"✓ {media_type.capitalize()} {status}")
 
+@Client.on_callback_query(filters.regex(r"^source_toggle:") & filters.user(OWNER_ID))
+async def source_toggle_callback(client: Client, callback: CallbackQuery):
+    user_id = int(callback.data.split(":")[1])
+    
+    if callback.from_user.id != user_id:
+        await callback.answer("❌ This is not your session!", show_alert=True)
+        return
+    
+    session = session_manager.get_session(user_id)
+    if not session:
+        await callback.answer("❌ Session expired!", show_alert=True)
+        return
+    
+    if session['source'] == 'zip' and not api_configured():
+        await callback.answer("❌ Dropbox API credentials are not configured!", show_alert=True)
+        return
+    
+    source = session_manager.toggle_source(user_id)
+    
+    await callback.edit_message_reply_markup(
+        reply_markup=get_main_menu_keyboard(user_id)
+    )
+    await callback.answer("✓ Listing files through the Dropbox API" if source == 'api' else "✓ Downloading the whole folder as ZIP")
+
 @Client.on_callback_query(filters.regex(r"^channel_menu:") & filters.user(OWNER_ID))
 async def channel_menu_callback(client: Client, callback: CallbackQuery):
     user_id = int(callback.data.split(":")[1])
@@ -478,7 +322,8 @@ async def settings_callback(client: Client, callback: CallbackQuery):
         "⚙️ **Current Settings**\n\n"
         f"📎 **URL:** `{url[:40]}...`\n\n"
         f"📂 **Media Types:**\n" + "\n".join(media_list) + "\n\n"
-        f"📤 **Dump Channel:** `{dump_channel}`"
+        f"📤 **Dump Channel:** `{dump_channel}`\n"
+        f"🔀 **Source:** {'Dropbox API' if session['source'] == 'api' else 'ZIP'}"
     )
     
     keyboard = InlineKeyboardMarkup([
@@ -488,6 +333,11 @@ async def settings_callback(client: Client, callback: CallbackQuery):
     await callback.edit_message_text(settings_text, reply_markup=keyboard)
     await callback.answer()
 
+def active_job_for(url):
+    # Jobs are named after their link; copies of a link share one journal key
+    key = job_key(url)
+    return next((job for job in job_scheduler.jobs.values() if job_key(job.name) == key), None)
+
 @Client.on_callback_query(filters.regex(r"^download_start:") & filters.user(OWNER_ID))
 async def download_start_callback(client: Client, callback: CallbackQuery):
     user_id = int(callback.data.split(":")[1])
@@ -508,167 +358,430 @@ async def download_start_callback(client: Client, callback: CallbackQuery):
     
     url = session['url']
     dump_channel = session['dump_channel']
+    source = session['source']
+    selected = set(media_types)
+    status_msg = callback.message
+
+    # A second press must not start another job on the same journal and work dir
+    existing = active_job_for(url)
+    if existing:
+        await callback.answer(f"⚠️ This link is already {existing.state} as job #{existing.id}")
+        return
     
-    await callback.answer("🚀 Starting download...")
-    
-    await callback.edit_message_text("🚀 Initializing download...")
+    job = job_scheduler.submit(
+        url,
+        lambda job: process_download(client, status_msg, url, dump_channel, selected, user_id, source, job),
+        owner=user_id
+    )
+    position = job_scheduler.position(job)
     
-    await process_download(client, callback.message, url, dump_channel, media_types, user_id)
+    if position:
+        await callback.answer(f"🕒 Queued as job #{job.id}")
+        await callback.edit_message_text(
+            f"🕒 Job #{job.id} queued (position {position}).\n"
+            f"Use /queue to see the queue or /cancel {job.id} to drop it."
+        )
+    else:
+        await callback.answer("🚀 Starting download...")
+        await callback.edit_message_text(f"🚀 Initializing download (job #{job.id})...")
+
+async def resume_jobs(client: Client):
+    for journal in journal_store.pending():
+        data = journal.data
+        chat_id = data['status_chat_id'] or data['user_id']
+        try:
+            status_msg = await client.send_message(chat_id, "♻️ Resuming interrupted backup...")
+        except Exception as e:
+            print(f"⚠️ Could not resume job {journal.key}: {e}")
+            continue
+        print(f"♻️ Resuming job {journal.key} ({len(data['uploaded'])} files already uploaded)")
+        # Interrupted jobs were started before anything queued now, so they go first
+        job_scheduler.submit(
+            data['url'],
+            lambda job, data=data, status_msg=status_msg: process_download(
+                client, status_msg, data['url'], data['dump_channel'], set(data['media_types']),
+                data['user_id'], data.get('source', 'zip'), job
+            ),
+            priority=1,
+            owner=data['user_id']
+        )
+
+async def process_download(client: Client, status_msg: Message, url: str, dump_channel: int, media_types: set, user_id: int, source: str = "zip", job=None):
+    journal = journal_store.open(url, user_id, dump_channel, media_types, source)
+    if journal is None:
+        await status_msg.edit_text("⚠️ This link is already being processed.")
+        return
+    journal.set_status_message(status_msg.chat.id, status_msg.id)
+    # Every stage reports through this instead of editing status_msg itself
+    status = StatusReporter(status_msg).start()
+    # Spans from this task and the tasks it starts land in the job's trace
+    trace = JobTrace(live_trace_path(journal.key))
+    current_trace.set(trace)
+    if job:
+        job.trace = trace
+    job_span = trace.span("job", source=source, mode=EXTRACT_MODE, resumed=journal.resumed)
+    job_span.__enter__()
+    outcome = "ok"
+    # The exception that ended the job, handed to the span when it closes
+    job_error = None
 
-async def process_download(client: Client, status_msg: Message, url: str, dump_channel: int, media_types: set, user_id: int):
-    temp_dir = f"downloads/{status_msg.id}"
-    os.makedirs(temp_dir, exist_ok=True)
+    temp_dir = journal.work_dir
     zip_path = f"{temp_dir}/download.zip"
     extract_path = f"{temp_dir}/extracted"
+    # Only a cancelled job (bot shutting down) keeps its journal and files
+    keep_job = False
 
     try:
         from utils.downloader import SmartDownloader
+
+        def track(stage, prog):
+            if job:
+                job.progress[stage] = prog
+            return prog
         
         async def download_progress(current, total):
              if not hasattr(download_progress, 'prog'):
-                 download_progress.prog = Progress(status_msg, total, "Downloading")
+                 download_progress.prog = track("download", Progress(status, total, "Downloading"))
+             journal.set_downloaded(current)
              await download_progress.prog.update(current)
         
         downloader = SmartDownloader(
             url, 
             zip_path, 
-            concurrency=4,  # Reduced for Dropbox compatibility
             progress_callback=download_progress
         )
         
-        await status_msg.edit_text("⬇️ Downloading (with fallback support)...")
-        await downloader.download()
-        await downloader.close()
-        
-        await status_msg.edit_text("📦 Extracting files...")
-        async def extract_progress(current, total):
-            if not hasattr(extract_progress, 'prog'):
-                extract_progress.prog = Progress(status_msg, total, "Extracting")
-            await extract_progress.prog.update(current)
+        def is_wanted(filename):
+            if filename.lower().endswith('.json'):
+                return False
+            ext = os.path.splitext(filename)[1].lower()
+            return should_process_file(filename, media_types, ext)
 
-        await extract_zip(zip_path, extract_path, progress_callback=extract_progress)
-        
-        await status_msg.edit_text("🔍 Scanning files...")
+        def member_key(path):
+            return os.path.relpath(path, extract_path).replace(os.sep, '/')
 
-        files = []
-        for root, dirs, filenames in os.walk(extract_path):
-            for filename in filenames:
-                if filename.lower().endswith('.json'):
-                    continue
-                
-                file_path = os.path.join(root, filename)
-                ext = os.path.splitext(filename)[1].lower()
-                
-                if should_process_file(filename, media_types, ext):
-                    files.append(file_path)
-
-        total_files = len(files)
-        if total_files == 0:
-            await status_msg.edit_text("⚠️ No matching media files found in archive.")
+        # Extracted path -> ZIP CRC32/size identity used by the dedup cache
+        content_keys = {}
+
+        def remember_keys(infos):
+            for info in infos:
+                path = safe_member_path(extract_path, info.filename)
+                if path:
+                    content_keys[path] = content_key(info.CRC, info.file_size)
+
+        bots = {session.name: session for session in [client] + client_pool.helpers}
+
+        def find_duplicate(path):
+            if DEDUP_MODE not in ("skip", "resend") or path not in content_keys:
+                return None
+            cached = dedup_cache.lookup(dump_channel, content_keys[path])
+            if cached and DEDUP_MODE == "resend" and cached['bot'] not in bots:
+                # file_ids only work for the bot that uploaded them
+                return None
+            return cached
+
+        async def admit_job(archive_size, member_sizes):
+            needed = estimate_peak(archive_size, member_sizes)
+            if needed > disk_guard.free_space() - disk_guard.reserve:
+                status.publish("💾 Waiting for disk space...")
+            if await disk_guard.admit(journal.key, needed):
+                return True
+            await status.finish(
+                f"❌ Not enough disk space.\n"
+                f"This job needs about {needed / (1024**3):.2f} GB, "
+                f"only {disk_guard.free_space() / (1024**3):.2f} GB is free."
+            )
             session_manager.delete_session(user_id)
-            return
-            
-        uploaded = 0
-        compressed_count = 0
-        upload_prog = Progress(status_msg, total_files, "Processing & Uploading")
+            return False
 
-        pending_photos = []
+        async def remote_members():
+            # Two small range requests read the central directory, so sizes
+            # are known before a single archive byte is downloaded
+            try:
+                tail = await downloader.fetch_tail(65536 + 22)
+                span = central_directory_span(tail)
+                if span is None:
+                    return None
+                if span > len(tail):
+                    tail = await downloader.fetch_tail(span)
+                return list_members_from_tail(tail)
+            except Exception as e:
+                print(f"⚠️ Could not read the remote central directory: {e}")
+                return None
 
-        async def flush_album():
-            nonlocal pending_photos, uploaded
-            if not pending_photos:
+        def remove_archive():
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
+                print(f"🧹 Removed archive {zip_path} after extraction")
+
+        def discard_source(path):
+            # The extracted copy is only needed until Telegram has the file
+            if isinstance(path, str) and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except Exception as e:
+                    print(f"Cleanup error: {e}")
+
+        leftovers = None
+        if source == "api":
+            # Only the files that pass the media filter are ever downloaded
+            streaming = False
+            status.publish("🔍 Listing shared folder through the Dropbox API...")
+            with span("scan", remote=True):
+                listing = await list_shared_link(url)
+            entries = [
+                entry for entry in listing
+                if is_wanted(os.path.basename(entry['name']))
+                and safe_member_path(extract_path, entry['name'])
+            ]
+            total_files = len(entries)
+            for entry in entries:
+                if entry['content_hash']:
+                    content_keys[safe_member_path(extract_path, entry['name'])] = dropbox_content_key(entry['content_hash'])
+            if total_files == 0:
+                await status.finish("⚠️ No matching media files found in shared folder.")
+                session_manager.delete_session(user_id)
                 return
+            if not await admit_job(0, [entry['size'] for entry in entries]):
+                return
+        else:
+            remote_size = 0
+            try:
+                remote_size, remote_etag = await downloader.probe()
+            except Exception as e:
+                print(f"⚠️ Could not probe {url[:50]}: {e}")
+            else:
+                if not journal.matches_remote(remote_size, remote_etag):
+                    print(f"⚠️ Link {journal.key} now serves a different file, starting over")
+                    journal.reset()
+                journal.set_remote(remote_size, remote_etag)
 
-            max_retries = 3
-            retry_count = 0
+            # A resumed job goes through the archive on disk: the ranged download
+            # picks up where it stopped and finished members are skipped
+            streaming = EXTRACT_MODE == "stream" and not journal.resumed
+            archive_on_disk = journal.data['download_complete'] and os.path.exists(zip_path)
 
-            while retry_count < max_retries:
-                try:
-                    media_group = []
-                    for idx, item in enumerate(pending_photos):
-                        media_group.append(
-                            InputMediaPhoto(
-                                media=item["upload_path"],
-                                caption=item["caption"] if idx == 0 else None
-                            )
-                        )
+            if journal.data.get('extraction_complete') and not archive_on_disk:
+                # The archive was deleted after a full extraction, so whatever
+                # is left to upload is already on disk
+                streaming = False
+                leftovers = [
+                    os.path.join(extract_path, key) for key in journal.data['extracted']
+                    if is_wanted(os.path.basename(key)) and not journal.is_uploaded(key)
+                    and os.path.exists(os.path.join(extract_path, key))
+                ]
+                if not await admit_job(0, []):
+                    return
+            else:
+                with span("scan", remote=not archive_on_disk):
+                    infos = list_zip_members(zip_path) if archive_on_disk else await remote_members()
+                if infos is not None:
+                    sizes = [info.file_size for info in infos if is_wanted(os.path.basename(info.filename))]
+                else:
+                    # Without the central directory, assume everything is wanted
+                    sizes = [remote_size]
+                if not await admit_job(0 if streaming or archive_on_disk else remote_size, sizes):
+                    return
 
-                    await client.send_media_group(
-                        chat_id=dump_channel,
-                        media=media_group
-                    )
+            if leftovers is not None:
+                members = []
+                total_files = len(leftovers) + len(journal.data['uploaded'])
+                if total_files == 0:
+                    await status.finish("⚠️ No matching media files found in archive.")
+                    session_manager.delete_session(user_id)
+                    return
+            elif streaming:
+                # Entry count is unknown until the stream reaches the central directory
+                total_files = 0
+                status.publish("⬇️ Downloading & extracting (streaming)...")
+            else:
+                if not archive_on_disk:
+                    status.publish("⬇️ Downloading (with fallback support)...")
+                    async with job_scheduler.slot("download"):
+                        with span("download") as download_span:
+                            await downloader.download()
+                            download_span.bytes = downloader.total_size
+                    await downloader.close()
+                    journal.mark_downloaded()
 
-                    uploaded += len(pending_photos)
-                    await upload_prog.update(uploaded)
-                    break
+                status.publish("🔍 Scanning files...")
 
-                except FloodWait as e:
-                    print(f"⏳ FloodWait (album): Sleeping {e.value}s...")
-                    await asyncio.sleep(e.value)
-                    retry_count += 1
+                with span("scan"):
+                    members = [
+                        info for info in list_zip_members(zip_path)
+                        if is_wanted(os.path.basename(info.filename))
+                        and safe_member_path(extract_path, info.filename)
+                    ]
+                total_files = len(members)
+                remember_keys(members)
+                if total_files == 0:
+                    await status.finish("⚠️ No matching media files found in archive.")
+                    session_manager.delete_session(user_id)
+                    return
+
+        uploaded = len(journal.data['uploaded'])
+        compressed_count = 0
+        deduplicated = 0
+        failed = 0
+        upload_prog = track("upload", Progress(status, total_files, "Processing & Uploading"))
+
+        pending_photos = []
+        prepared_count = 0
+        # Split members whose parts are still uploading: source member key ->
+        # parts left, whether one failed, and the manifest sent after the last part
+        split_groups = {}
+
+        async def emit_parts(file_path, filename, parts, mode):
+            # Parts go straight to the upload workers; only the manifest counts
+            # towards the uploaded total so stats stay per source file
+            manifest_path = write_manifest(file_path, parts, mode)
+            manifest = {
+                "member": member_key(file_path),
+                "file_path": file_path,
+                "filename": os.path.basename(manifest_path),
+                "upload_path": manifest_path,
+                "caption": f"🧾 Manifest: {filename} ({len(parts)} parts)",
+                "compressed": True,
+                "ext": ".json",
+            }
+            pending = []
+            for index, part in enumerate(parts, start=1):
+                if journal.is_part_uploaded(member_key(part)):
+                    # A resumed job splits the member again; parts sent
+                    # before the restart are not kept on disk
+                    discard_source(part)
+                else:
+                    pending.append((index, part))
+            if not pending:
+                return manifest
+            split_groups[manifest["member"]] = {"pending": len(pending), "failed": False, "manifest": manifest}
+
+            for index, part in pending:
+                await pipeline.emit("prepare", {
+                    "member": member_key(part),
+                    "part": True,
+                    "group": manifest["member"],
+                    "file_path": file_path,
+                    "filename": os.path.basename(part),
+                    "upload_path": part,
+                    "caption": f"📦 Backup: {filename} (part {index}/{len(parts)})",
+                    "compressed": True,
+                    "ext": os.path.splitext(part)[1].lower(),
+                })
+            return None
+
+        async def reuse_upload(source, path, cached):
+            nonlocal prepared_count, uploaded, deduplicated
+            prepared_count += 1
+            if streaming:
+                upload_prog.total_size = prepared_count
+            if isinstance(source, ZipMemberReader):
+                source.close()
+
+            filename = os.path.basename(path)
+            if DEDUP_MODE == "skip":
+                discard_source(source)
+                journal.mark_uploaded(member_key(path), [cached['message_id']])
+                uploaded += 1
+                deduplicated += 1
+                await upload_prog.update(uploaded)
+                return None
+            return {
+                "member": member_key(path),
+                "file_path": path,
+                "filename": filename,
+                "upload_path": None,
+                "cached": cached,
+                "caption": f"📁 Backup: {filename}",
+                "compressed": False,
+                "ext": os.path.splitext(filename)[1].lower(),
+            }
+
+        async def prepare_file(file_path):
+            nonlocal compressed_count, prepared_count
+            if isinstance(file_path, ZipMemberReader):
+                path = safe_member_path(extract_path, file_path.info.filename)
+                cached = find_duplicate(path)
+                if cached:
+                    return await reuse_upload(file_path, path, cached)
+                # Read in place from the archive; nothing to convert
+                prepared_count += 1
+                return {
+                    "member": member_key(path),
+                    "content_key": content_keys.get(path),
+                    "file_path": file_path,
+                    "filename": file_path.name,
+                    "upload_path": file_path,
+                    "caption": f"📁 Backup: {file_path.name}",
+                    "compressed": False,
+                    "ext": os.path.splitext(file_path.name)[1].lower(),
+                }
 
-                except Exception as e:
-                    print(f"❌ Album upload error: {e}")
-                    retry_count += 1
-                    if retry_count >= max_retries:
-                        print(f"⚠️ Skipping album after {max_retries} retries")
-                        break
-                    await asyncio.sleep(2)
-
-            for item in pending_photos:
-                if item["compressed"] and os.path.exists(item["upload_path"]) and item["upload_path"] != item["file_path"]:
-                    try:
-                        os.remove(item["upload_path"])
-                    except Exception as e:
-                        print(f"Cleanup error: {e}")
-
-            pending_photos = []
-
-        for i, file_path in enumerate(files):
             filename = os.path.basename(file_path)
+            if not is_wanted(filename) or journal.is_uploaded(member_key(file_path)):
+                discard_source(file_path)
+                return None
+            cached = find_duplicate(file_path)
+            if cached:
+                return await reuse_upload(file_path, file_path, cached)
+
+            prepared_count += 1
+            i = prepared_count - 1
+            if streaming:
+                upload_prog.total_size = prepared_count
             ext = os.path.splitext(filename)[1].lower()
             file_size = os.path.getsize(file_path)
-            
+
             upload_path = file_path
             caption = f"📁 Backup: {filename}"
             compressed = False
-            
+
             if ext in IMAGE_FORMATS or ext in HEIF_FORMATS:
-                await status_msg.edit_text(
+                status.publish(
                     f"🖼️ Processing image ({i+1}/{total_files})\n"
                     f"📄 {filename}\n"
                     f"📊 Size: {file_size / (1024*1024):.2f} MB"
                 )
-                
-                if ext in HEIF_FORMATS:
-                    target_ext = '.jpg'
-                    converted_path = f"{file_path}_converted{target_ext}"
-                    if await convert_heic_to_jpeg(file_path, converted_path):
-                        upload_path = converted_path
-                        compressed = True
-                        compressed_count += 1
-                        caption = f"🖼️ Backup: {os.path.splitext(filename)[0]}{target_ext}"
-                        ext = target_ext
-                    else:
-                        caption = f"📁 Backup (Original HEIC): {filename}"
-
-                if ext in IMAGE_FORMATS:
-                    fixed_path = await ensure_valid_photo_dimensions(upload_path)
-                    if fixed_path != upload_path:
-                        upload_path = fixed_path
-                        compressed = True
-                        compressed_count += 1
-                        ext = os.path.splitext(upload_path)[1].lower()
-            
+
+                with span("convert", file=filename) as convert_span:
+                    convert_span.bytes = file_size
+                    photo_path = await prepare_photo(file_path)
+                if photo_path is None:
+                    caption = f"📁 Backup (Original HEIC): {filename}"
+                elif photo_path != file_path:
+                    upload_path = photo_path
+                    compressed = True
+                    compressed_count += 1
+                    if ext in HEIF_FORMATS:
+                        caption = f"🖼️ Backup: {os.path.splitext(filename)[0]}.jpg"
+                    ext = '.jpg'
+
+            elif file_size > MAX_TELEGRAM_SIZE and (ext not in VIDEO_FORMATS or OVERSIZE_MODE == "split"):
+                status.publish(
+                    f"✂️ Splitting oversize file ({i+1}/{total_files})\n"
+                    f"📄 {filename}\n"
+                    f"📊 Size: {file_size / (1024*1024*1024):.2f} GB"
+                )
+                with span("split", file=filename) as split_span:
+                    split_span.bytes = file_size
+                    parts = await split_video(file_path) if ext in VIDEO_FORMATS else None
+                    mode = "video" if parts else "bytes"
+                    if not parts:
+                        parts = await split_file(file_path)
+                return await emit_parts(file_path, filename, parts, mode)
+
             elif ext in VIDEO_FORMATS:
                 if file_size > MAX_TELEGRAM_SIZE:
                     compressed_path = f"{file_path}_compressed.mp4"
-                    await status_msg.edit_text(
+                    status.publish(
                         f"🎬 Compressing video ({i+1}/{total_files})\n"
                         f"📄 {filename}\n"
                         f"📊 Original: {file_size / (1024*1024*1024):.2f} GB"
                     )
-                    if await compress_video_h265(file_path, compressed_path, status_msg):
+                    with span("transcode", file=filename) as transcode_span:
+                        transcode_span.bytes = file_size
+                        transcoded = await compress_video_h265(file_path, compressed_path, status)
+                    if transcoded:
                         compressed_size = os.path.getsize(compressed_path)
                         if compressed_size < MAX_TELEGRAM_SIZE:
                             upload_path = compressed_path
@@ -677,107 +790,431 @@ async def process_download(client: Client, status_msg: Message, url: str, dump_c
                             caption = f"🎬 Backup (H.265 Compressed): {os.path.basename(compressed_path)}"
                             ext = '.mp4'
                         else:
-                            await status_msg.edit_text(
+                            status.publish(
                                 f"⚠️ Video masih terlalu besar setelah compress: {filename}\n"
                                 f"Skipping file ini..."
                             )
                             if os.path.exists(compressed_path):
                                 os.remove(compressed_path)
-                            continue
+                            return None
                     else:
-                        await status_msg.edit_text(
+                        status.publish(
                             f"❌ Compression gagal: {filename}\n"
                             f"Skipping file ini..."
                         )
-                        continue
+                        return None
 
-            if ext in IMAGE_FORMATS:
-                pending_photos.append({
-                    "file_path": file_path,
-                    "upload_path": upload_path,
-                    "caption": caption,
-                    "compressed": compressed,
-                })
+            return {
+                "member": member_key(file_path),
+                "content_key": content_keys.get(file_path),
+                "file_path": file_path,
+                "filename": filename,
+                "upload_path": upload_path,
+                "caption": caption,
+                "compressed": compressed,
+                "ext": ext,
+            }
 
-                if len(pending_photos) >= 10:
-                    await flush_album()
+        def upload_size(item):
+            if "cached" in item:
+                return 0
+            if isinstance(item["upload_path"], ZipMemberReader):
+                return item["upload_path"].size
+            return os.path.getsize(item["upload_path"])
 
-                continue
+        def cleanup_upload(item):
+            upload_path = item["upload_path"]
+            if "cached" in item:
+                return
+            if isinstance(upload_path, ZipMemberReader):
+                upload_path.close()
+            elif item["compressed"] and os.path.exists(upload_path) and upload_path != item["file_path"]:
+                try:
+                    os.remove(upload_path)
+                except Exception as e:
+                    print(f"Cleanup error: {e}")
+
+        async def batch_photos(item):
+            nonlocal pending_photos
+            if item["ext"] in IMAGE_FORMATS and "cached" not in item:
+                pending_photos.append(item)
+                if len(pending_photos) < 10:
+                    return None
+                album, pending_photos = pending_photos, []
+                return {"album": album}
 
             if pending_photos:
-                await flush_album()
+                album, pending_photos = pending_photos, []
+                await pipeline.emit("batch", {"album": album})
+            return item
 
-            max_retries = 3
-            retry_count = 0
+        async def flush_album():
+            nonlocal pending_photos
+            if pending_photos:
+                album, pending_photos = pending_photos, []
+                await pipeline.emit("batch", {"album": album})
 
-            while retry_count < max_retries:
-                try:
-                    if ext in VIDEO_FORMATS:
-                        await client.send_video(
-                            chat_id=dump_channel,
-                            video=upload_path,
-                            caption=caption,
-                            supports_streaming=True,
-                            progress=lambda current, total: None
+        async def finish_part(item, result):
+            nonlocal failed
+            group = split_groups[item["group"]]
+            if result is not None:
+                journal.mark_part_uploaded(item["member"], [result.id])
+            else:
+                group["failed"] = True
+            group["pending"] -= 1
+            if group["pending"]:
+                return
+            del split_groups[item["group"]]
+            if group["failed"]:
+                # The member stays pending, so a resumed job splits it again
+                # and sends only the parts that are missing
+                failed += 1
+                print(f"❌ Parts of {group['manifest']['file_path']} failed, manifest not sent")
+                cleanup_upload(group["manifest"])
+                return
+            await upload_file(group["manifest"])
+
+        async def upload_file(item):
+            nonlocal uploaded, deduplicated, failed
+
+            if "album" in item:
+                album = item["album"]
+
+                album_size = sum(upload_size(photo) for photo in album)
+                sent_by = []
+
+                async def send_album(session):
+                    sent_by.append(session.name)
+                    media_group = []
+                    for idx, photo in enumerate(album):
+                        media_group.append(
+                            InputMediaPhoto(
+                                media=photo["upload_path"],
+                                caption=photo["caption"] if idx == 0 else None
+                            )
                         )
-                    else:
-                        await client.send_document(
-                            chat_id=dump_channel,
-                            document=upload_path,
-                            caption=caption,
-                            progress=lambda current, total: None
+                    return await session.send_media_group(chat_id=dump_channel, media=media_group)
+
+                with span("album_flush", photos=len(album)) as album_span:
+                    album_span.bytes = album_size
+                    async with job_scheduler.slot("upload"):
+                        result = await upload_limiter.send(
+                            dump_channel,
+                            album_size,
+                            lambda: client_pool.send(client, album_size, send_album),
+                            "album",
+                            cost=len(album),
                         )
-                    
-                    uploaded += 1
+                    album_span.set(sent=result is not None)
+                if result is not None:
+                    for photo, sent in zip(album, result):
+                        journal.mark_uploaded(photo["member"], [sent.id])
+                        discard_source(photo["file_path"])
+                        if photo.get("content_key"):
+                            dedup_cache.store(dump_channel, photo["content_key"], sent, sent_by[-1], photo["filename"])
+                    uploaded += len(album)
                     await upload_prog.update(uploaded)
-                    break
-                    
-                except FloodWait as e:
-                    print(f"⏳ FloodWait: Sleeping {e.value}s...")
-                    await asyncio.sleep(e.value)
-                    retry_count += 1
-                    
-                except Exception as e:
-                    print(f"❌ Upload error for {filename}: {e}")
-                    retry_count += 1
-                    if retry_count >= max_retries:
-                        print(f"⚠️ Skipping {filename} after {max_retries} retries")
-                        break
-                    await asyncio.sleep(2)
-            
-            if compressed and os.path.exists(upload_path) and upload_path != file_path:
-                try:
-                    os.remove(upload_path)
-                except Exception as e:
-                    print(f"Cleanup error: {e}")
+                else:
+                    failed += len(album)
+                for photo in album:
+                    cleanup_upload(photo)
+                return None
+
+            async def send_file(session):
+                item["bot"] = session.name
+                if item["ext"] in VIDEO_FORMATS:
+                    return await session.send_video(
+                        chat_id=dump_channel,
+                        video=item["upload_path"],
+                        caption=item["caption"],
+                        supports_streaming=True,
+                        progress=lambda current, total: None
+                    )
+                return await session.send_document(
+                    chat_id=dump_channel,
+                    document=item["upload_path"],
+                    caption=item["caption"],
+                    progress=lambda current, total: None
+                )
+
+            async def send_cached():
+                # No bytes move; Telegram reuses the file the same bot sent before
+                return await bots[item["cached"]["bot"]].send_cached_media(
+                    chat_id=dump_channel,
+                    file_id=item["cached"]["file_id"],
+                    caption=item["caption"]
+                )
 
-        if pending_photos:
-            await flush_album()
+            file_size = upload_size(item)
+            with span("upload", file=item["filename"], cached="cached" in item) as upload_span:
+                upload_span.bytes = file_size
+                async with job_scheduler.slot("upload"):
+                    result = await upload_limiter.send(
+                        dump_channel,
+                        file_size,
+                        send_cached if "cached" in item else lambda: client_pool.send(client, file_size, send_file),
+                        item["filename"],
+                    )
+                upload_span.set(sent=result is not None)
+            if item.get("part"):
+                cleanup_upload(item)
+                await finish_part(item, result)
+                return None
+            if result is not None:
+                journal.mark_uploaded(item["member"], [result.id])
+                # For a split file this is the manifest, sent after all its parts
+                discard_source(item["file_path"])
+                if "cached" in item:
+                    deduplicated += 1
+                elif item.get("content_key"):
+                    dedup_cache.store(dump_channel, item["content_key"], result, item["bot"], item["filename"])
+                uploaded += 1
+                await upload_prog.update(uploaded)
+            else:
+                failed += 1
+            cleanup_upload(item)
+            return None
+
+        async def extract_progress(current, total):
+            if not hasattr(extract_progress, 'prog'):
+                extract_progress.prog = track("extract", Progress(status, total, "Extracting"))
+            await extract_progress.prog.update(current)
+
+        # Files flow extract -> prepare -> batch -> upload as soon as each one is
+        # on disk, so conversion of the next file overlaps the current uploads
+        pipeline = Pipeline()
+        pipeline.add_stage("prepare", prepare_file, workers=IMAGE_WORKERS)
+        pipeline.add_stage("batch", batch_photos, on_close=flush_album)
+        pipeline.add_stage("upload", upload_file, workers=UPLOAD_WORKERS)
 
-        await status_msg.edit_text(
+        async def on_extracted(path):
+            journal.mark_extracted(member_key(path))
+            await pipeline.put(path)
+
+        async def stream_source():
+            async def on_streamed(path):
+                content_keys[path] = content_key(*extractor.checksums[path])
+                await on_extracted(path)
+
+            extractor = ZipStreamExtractor(
+                extract_path,
+                file_callback=on_streamed,
+                wanted=lambda name: is_wanted(os.path.basename(name)),
+            )
+            try:
+                async with job_scheduler.slot("download"):
+                    # Extraction happens inside this span as the bytes arrive
+                    with span("download", streaming=True) as download_span:
+                        try:
+                            await downloader.download_stream(extractor)
+                        finally:
+                            # A failed or cancelled stream leaves its current entry open
+                            await extractor.close()
+                        download_span.bytes = downloader.downloaded
+            except Exception as e:
+                print(f"⚠️ Streaming extraction failed ({e}), falling back to full download...")
+                async with job_scheduler.slot("download"):
+                    with span("download") as download_span:
+                        await downloader.download()
+                        download_span.bytes = downloader.total_size
+                await downloader.close()
+                journal.mark_downloaded()
+                with span("scan"):
+                    infos = list_zip_members(zip_path)
+                remember_keys(infos)
+                skip_names = extractor.completed_names | {
+                    info.filename for info in infos if not is_wanted(os.path.basename(info.filename))
+                }
+                with span("extract") as extract_span:
+                    extract_span.bytes = sum(info.file_size for info in infos if info.filename not in skip_names)
+                    await extract_zip(
+                        zip_path,
+                        extract_path,
+                        progress_callback=extract_progress,
+                        file_callback=on_extracted,
+                        skip_names=skip_names,
+                    )
+                journal.mark_extraction_complete()
+                remove_archive()
+
+        def can_read_in_place(info):
+            # Photos get decoded and possibly re-encoded and oversize files are
+            # transcoded or split, so those still need a real file on disk
+            ext = os.path.splitext(info.filename)[1].lower()
+            if ext in IMAGE_FORMATS or ext in HEIF_FORMATS:
+                return False
+            return info.file_size <= MAX_TELEGRAM_SIZE
+
+        def resume_members():
+            # Members already uploaded are skipped outright; ones extracted
+            # before the restart are fed from disk instead of extracted again
+            on_disk, skip_names = [], set()
+            for info in members:
+                path = safe_member_path(extract_path, info.filename)
+                key = member_key(path)
+                if journal.is_uploaded(key):
+                    skip_names.add(info.filename)
+                elif key in journal.data['extracted'] and os.path.exists(path) and os.path.getsize(path) == info.file_size:
+                    on_disk.append(path)
+                    skip_names.add(info.filename)
+            return on_disk, skip_names
+
+        async def in_place_source(archive):
+            on_disk, skip_names = resume_members()
+            for path in on_disk:
+                await pipeline.put(path)
+            for info in members:
+                if info.filename in skip_names:
+                    continue
+                if can_read_in_place(info) or find_duplicate(safe_member_path(extract_path, info.filename)):
+                    await pipeline.put(ZipMemberReader(archive, info))
+                else:
+                    with span("extract", file=os.path.basename(info.filename)) as extract_span:
+                        extract_span.bytes = info.file_size
+                        path = await extract_member(archive, info, extract_path)
+                    await on_extracted(path)
+
+        async def disk_source(archive):
+            on_disk, skip_names = resume_members()
+            for path in on_disk:
+                await pipeline.put(path)
+            # Known duplicates are never extracted; prepare_file reuses the
+            # cached upload without reading the member
+            for info in members:
+                if info.filename not in skip_names and find_duplicate(safe_member_path(extract_path, info.filename)):
+                    skip_names.add(info.filename)
+                    await pipeline.put(ZipMemberReader(archive, info))
+            # Members outside the media filter are never written to disk
+            wanted_names = {info.filename for info in members}
+            skip_names |= {
+                info.filename for info in archive.infolist() if info.filename not in wanted_names
+            }
+            with span("extract") as extract_span:
+                extract_span.bytes = sum(info.file_size for info in members if info.filename not in skip_names)
+                await extract_zip(
+                    zip_path,
+                    extract_path,
+                    progress_callback=extract_progress,
+                    file_callback=on_extracted,
+                    skip_names=skip_names,
+                )
+            journal.mark_extraction_complete()
+            remove_archive()
+
+        async def leftover_source():
+            for path in leftovers:
+                await pipeline.put(path)
+
+        async def api_source():
+            # A few files download at a time and each one enters the pipeline
+            # as soon as it is on disk, just like an extracted member
+            pending = iter(entries)
+            total_bytes = sum(entry['size'] for entry in entries)
+            fetched_bytes = 0
+
+            async def fetch_worker():
+                nonlocal fetched_bytes, failed
+                for entry in pending:
+                    path = safe_member_path(extract_path, entry['name'])
+                    key = member_key(path)
+                    if journal.is_uploaded(key):
+                        continue
+                    if find_duplicate(path):
+                        await pipeline.put(path)
+                        continue
+                    on_disk = key in journal.data['extracted'] and os.path.exists(path) and os.path.getsize(path) == entry['size']
+                    if not on_disk:
+                        try:
+                            with span("download", file=entry['name']) as download_span:
+                                download_span.bytes = entry['size']
+                                await download_shared_file(url, entry, path)
+                        except Exception as e:
+                            # The download span has recorded the error; the
+                            # member stays pending for a resumed job
+                            failed += 1
+                            status.publish(
+                                f"❌ Download gagal: {entry['name']}\n"
+                                f"{str(e)[:200]}"
+                            )
+                            continue
+                    fetched_bytes += entry['size']
+                    await download_progress(fetched_bytes, total_bytes)
+                    await on_extracted(path)
+
+            async with job_scheduler.slot("download"):
+                await asyncio.gather(*(fetch_worker() for _ in range(DROPBOX_API_WORKERS)))
+
+        if source == "api":
+            await pipeline.run(api_source())
+        elif leftovers is not None:
+            await pipeline.run(leftover_source())
+        elif streaming:
+            await pipeline.run(stream_source())
+            total_files = prepared_count
+            if total_files == 0:
+                await status.finish("⚠️ No matching media files found in archive.")
+                session_manager.delete_session(user_id)
+                return
+        else:
+            # One handle on the archive serves every member of the job
+            with zipfile.ZipFile(zip_path, 'r') as archive:
+                if EXTRACT_MODE == "inplace":
+                    await pipeline.run(in_place_source(archive))
+                else:
+                    await pipeline.run(disk_source(archive))
+
+        await status.finish(
             f"✅ Upload Complete!\n\n"
             f"📊 Statistics:\n"
             f"• Total files: {total_files}\n"
             f"• Uploaded: {uploaded}\n"
             f"• Compressed: {compressed_count}\n"
-            f"• Success rate: {(uploaded/total_files)*100:.1f}%"
+            f"• Deduplicated: {deduplicated}\n"
+            f"• Failed: {failed}\n"
+            f"• Success rate: {(uploaded/max(total_files, 1))*100:.1f}%"
         )
         
         session_manager.delete_session(user_id)
 
+    except asyncio.CancelledError as e:
+        job_error = e
+        if job and job.cancelled:
+            outcome = "cancelled"
+            await status.finish(f"🛑 Job #{job.id} cancelled.")
+            session_manager.delete_session(user_id)
+        else:
+            outcome = "interrupted"
+            keep_job = True
+            print(f"⏸️ Job {journal.key} interrupted, it will resume on the next start")
+        raise
+
     except Exception as e:
-        await status_msg.edit_text(f"❌ Error: {str(e)}")
+        outcome = "error"
+        job_error = e
+        await status.finish(f"❌ Error: {str(e)}")
         print(f"Error processing dropbox link: {e}")
         import traceback
         traceback.print_exc()
         session_manager.delete_session(user_id)
         
     finally:
-        try:
-            shutil.rmtree(temp_dir)
+        await status.stop()
+        await disk_guard.release(journal.key)
+        job_span.set(outcome=outcome)
+        if job_error is not None:
+            job_span.__exit__(type(job_error), job_error, job_error.__traceback__)
+        else:
+            job_span.__exit__(None, None, None)
+        if keep_job:
+            trace.close()
+            journal_store.release(journal)
+        else:
+            # The job directory goes away, the trace is kept for /trace
+            trace_path = trace.archive(journal.key)
+            if job:
+                job.trace_path = trace_path
+            journal_store.remove(journal)
             print(f"🧹 Cleaned up {temp_dir}")
-        except Exception as e:
-            print(f"⚠️ Cleanup failed for {temp_dir}: {e}")
 
 @Client.on_callback_query(filters.regex(r"^noop:"))
 async def noop_callback(client: Client, callback: CallbackQuery):
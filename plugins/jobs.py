@@ -0,0 +1,140 @@
+import os
+import glob
+import time
+from pyrogram import Client, filters
+from pyrogram.types import Message
+from config import OWNER_ID
+from utils.scheduler import job_scheduler
+from utils.progress import human_readable_size, format_duration
+from utils.tracer import TRACES_DIR, LIVE_TRACES_DIR, live_trace_path, load_trace, summarize
+
+# Runs before the channel-input handler in group 0, which would otherwise
+# treat these commands as a channel ID while it is waiting for one
+JOBS_GROUP = -1
+
+def _describe(job):
+    name = job.name if len(job.name) <= 40 else f"{job.name[:40]}..."
+    if job.state == "running":
+        elapsed = int(time.time() - job.started)
+        line = f"▶️ #{job.id} `{name}` (running {elapsed // 60}m {elapsed % 60}s)"
+        for stage, prog in job.progress.items():
+            snap = prog.snapshot()
+            if snap.total and snap.current >= snap.total:
+                continue
+            rate = f"{human_readable_size(snap.ewma_speed)}/s" if stage != "upload" else f"{snap.ewma_speed * 60:.1f} files/min"
+            line += f"\n    {stage}: {rate}, ETA {format_duration(snap.eta)}"
+        return line
+    return f"🕒 #{job.id} `{name}` (priority {job.priority})"
+
+@Client.on_message(filters.command("queue") & filters.user(OWNER_ID), group=JOBS_GROUP)
+async def queue_command(client: Client, message: Message):
+    running = job_scheduler.running()
+    queued = job_scheduler.queued()
+
+    if not running and not queued:
+        await message.reply_text("📭 No jobs running or queued.")
+    else:
+        lines = [_describe(job) for job in running + queued]
+        await message.reply_text(
+            f"📋 **Jobs** ({len(running)}/{job_scheduler.max_jobs} running, {len(queued)} queued)\n\n"
+            + "\n".join(lines)
+        )
+    message.stop_propagation()
+
+@Client.on_message(filters.command("cancel") & filters.user(OWNER_ID), group=JOBS_GROUP)
+async def cancel_command(client: Client, message: Message):
+    if len(message.command) < 2:
+        # A bare /cancel belongs to the custom channel prompt
+        message.continue_propagation()
+
+    try:
+        job_id = int(message.command[1].lstrip("#"))
+    except ValueError:
+        await message.reply_text("❌ Usage: /cancel <job id>")
+        message.stop_propagation()
+
+    if job_scheduler.cancel(job_id):
+        await message.reply_text(f"🛑 Cancelling job #{job_id}...")
+    else:
+        await message.reply_text(f"❌ No job #{job_id}. See /queue.")
+    message.stop_propagation()
+
+@Client.on_message(filters.command("priority") & filters.user(OWNER_ID), group=JOBS_GROUP)
+async def priority_command(client: Client, message: Message):
+    try:
+        job_id = int(message.command[1].lstrip("#"))
+        priority = int(message.command[2])
+    except (IndexError, ValueError):
+        await message.reply_text("❌ Usage: /priority <job id> <level> (higher starts first)")
+        message.stop_propagation()
+
+    if job_scheduler.set_priority(job_id, priority):
+        await message.reply_text(f"✅ Job #{job_id} priority set to {priority}.")
+    else:
+        await message.reply_text(f"❌ Job #{job_id} is not waiting in the queue.")
+    message.stop_propagation()
+
+def _find_trace(arg):
+    if not arg:
+        # The most recently written trace, running or finished
+        paths = glob.glob(os.path.join(LIVE_TRACES_DIR, "*.jsonl")) + glob.glob(os.path.join(TRACES_DIR, "*.jsonl"))
+        return max(paths, key=os.path.getmtime) if paths else None
+
+    if arg.lstrip("#").isdigit():
+        job = job_scheduler.find(int(arg.lstrip("#")))
+        if job is None:
+            return None
+        if job.trace_path:
+            return job.trace_path
+        return job.trace.path if job.trace else None
+
+    for path in (os.path.join(TRACES_DIR, f"{arg}.jsonl"), live_trace_path(arg)):
+        if os.path.exists(path):
+            return path
+    return None
+
+def _trace_summary(path):
+    records = load_trace(path)
+    if not records:
+        return "📭 The trace is empty."
+
+    wall = max(r["end"] for r in records) - min(r["start"] for r in records)
+    jobs = [r for r in records if r["name"] == "job"]
+    outcome = jobs[-1]["attrs"].get("outcome", "?") if jobs else "running"
+    lines = [
+        f"🧭 **Trace** `{os.path.basename(path)}`",
+        f"Wall time: {format_duration(wall)} • Outcome: {outcome} • Attempts: {max(len(jobs), 1)}",
+        "",
+        "Busy time per stage (spans overlap, so totals can exceed wall time):",
+    ]
+
+    totals = summarize(r for r in records if r["name"] != "job")
+    for name, total in sorted(totals.items(), key=lambda item: item[1]["duration"], reverse=True):
+        line = f"• `{name}` ×{total['count']}: {format_duration(total['duration'])}, max {format_duration(total['max'])}"
+        if total["bytes"]:
+            rate = total["bytes"] / total["duration"] if total["duration"] > 0 else 0
+            line += f", {human_readable_size(total['bytes'])} at {human_readable_size(rate)}/s"
+        if total["errors"]:
+            line += f", {total['errors']} failed"
+        lines.append(line)
+
+    slowest = sorted(
+        (r for r in records if "file" in r["attrs"] and r["name"] != "floodwait"),
+        key=lambda r: r["duration"], reverse=True,
+    )[:3]
+    if slowest:
+        lines.append("")
+        lines.append("Slowest files:")
+        for r in slowest:
+            lines.append(f"• {r['name']} `{r['attrs']['file']}`: {format_duration(r['duration'])}")
+    return "\n".join(lines)
+
+@Client.on_message(filters.command("trace") & filters.user(OWNER_ID), group=JOBS_GROUP)
+async def trace_command(client: Client, message: Message):
+    arg = message.command[1] if len(message.command) > 1 else None
+    path = _find_trace(arg)
+    if path is None or not os.path.exists(path):
+        await message.reply_text("❌ No trace found. Usage: /trace [job id or key]")
+    else:
+        await message.reply_text(_trace_summary(path))
+    message.stop_propagation()
@@ -0,0 +1,60 @@
+import time
+from pyrogram.errors import FloodWait
+from utils.metrics import FLOODWAIT_SECONDS
+from utils.tracer import event
+
+HELPER_ERROR_COOLDOWN = 60
+
+
+class ClientPool:
+    """Spreads uploads over the main bot and any helper bots. Each call goes
+    to the session with the fewest bytes in flight; a session that hits
+    FloodWait or fails is benched and the call moves on to another one."""
+
+    def __init__(self):
+        self.helpers = []
+        self.inflight = {}
+        self.benched_until = {}
+
+    def add_helper(self, client):
+        self.helpers.append(client)
+
+    def _pick(self, primary):
+        now = time.monotonic()
+        ready = [
+            client for client in [primary] + self.helpers
+            if self.benched_until.get(client, 0) <= now
+        ]
+        if not ready:
+            return None
+        return min(ready, key=lambda client: self.inflight.get(client, 0))
+
+    async def send(self, primary, size, send_func):
+        """Call `send_func(client)` on the least busy session."""
+        if not self.helpers:
+            return await send_func(primary)
+
+        while True:
+            client = self._pick(primary)
+            if client is None:
+                wait = min(self.benched_until.values()) - time.monotonic()
+                raise FloodWait(value=max(1, int(wait)))
+
+            self.inflight[client] = self.inflight.get(client, 0) + size
+            try:
+                return await send_func(client)
+            except FloodWait as e:
+                # FloodWait is per bot, so only this session has to wait
+                FLOODWAIT_SECONDS.inc(e.value, scope="bot")
+                event("floodwait", e.value, scope="bot", bot=client.name)
+                self.benched_until[client] = time.monotonic() + e.value
+            except Exception as e:
+                if client is primary:
+                    raise
+                print(f"⚠️ Helper {client.name} failed ({e}), benching it for {HELPER_ERROR_COOLDOWN}s")
+                self.benched_until[client] = time.monotonic() + HELPER_ERROR_COOLDOWN
+            finally:
+                self.inflight[client] -= size
+
+
+client_pool = ClientPool()
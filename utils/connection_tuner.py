@@ -0,0 +1,145 @@
+import os
+import json
+import time
+from urllib.parse import urlsplit
+from config import DOWNLOAD_CONNECTIONS, DOWNLOAD_MAX_CONNECTIONS, DOWNLOAD_TUNING_FILE
+from utils.metrics import DOWNLOAD_CONNECTIONS as CONNECTIONS_GAUGE
+from utils.tracer import event
+
+# Seconds of traffic behind every tuning decision
+TUNE_INTERVAL = 3.0
+# An added connection is kept only if it carries at least this share of what
+# an existing connection did; below that the link is saturated
+MIN_MARGINAL_GAIN = 0.5
+# Intervals to wait after a failed probe before trying one more connection
+HOLD_INTERVALS = 5
+# Hosts remembered in the tuning table; the least recently used are dropped
+MAX_HOSTS = 100
+
+
+def host_key(url):
+    # Dropbox redirects every link to its own content subdomain, so settings
+    # are remembered for the host of the shared link itself
+    host = urlsplit(url).netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+class TuningTable:
+    """Connection counts that worked per host, kept in DOWNLOAD_TUNING_FILE
+    so the next download starts where the last one settled."""
+
+    def __init__(self, path=DOWNLOAD_TUNING_FILE):
+        self.path = path
+        self._hosts = None
+
+    def _load(self):
+        if self._hosts is None:
+            try:
+                with open(self.path, 'r') as f:
+                    self._hosts = json.load(f)
+            except (OSError, ValueError):
+                self._hosts = {}
+        return self._hosts
+
+    def get(self, host):
+        entry = self._load().get(host)
+        return entry['connections'] if entry else None
+
+    def remember(self, host, connections, rate):
+        hosts = self._load()
+        hosts[host] = {'connections': connections, 'mb_s': round(rate / (1024 * 1024), 2), 'updated': time.time()}
+        for old in sorted(hosts, key=lambda name: hosts[name]['updated'])[:-MAX_HOSTS]:
+            del hosts[old]
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(hosts, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️ Could not save download tuning: {e}")
+
+
+tuning_table = TuningTable()
+
+
+class ConnectionTuner:
+    """AIMD controller for the connection count of one ranged download.
+
+    Every TUNE_INTERVAL the aggregate throughput is sampled. While a new
+    connection still adds at least MIN_MARGINAL_GAIN of the per-connection
+    rate, one more is added; when it does not, it is taken back and probing
+    pauses. A 403/429/503 halves the count and caps it below the level that
+    was throttled for the rest of the download. Refusals in the interval
+    after a cut come from requests sent before it and are not counted again."""
+
+    def __init__(self, url, connections=None):
+        self.host = host_key(url)
+        remembered = tuning_table.get(self.host)
+        self.remembered = remembered is not None and not connections
+        start = connections or remembered or DOWNLOAD_CONNECTIONS
+        self.ceiling = DOWNLOAD_MAX_CONNECTIONS
+        self.connections = max(1, min(start, self.ceiling))
+        self.best_rate = 0.0
+        self.best_connections = self.connections
+        self._throttled = False
+        self._draining = False
+        self._probing = False
+        # A count that worked before is held a while before probing past it
+        self._hold = HOLD_INTERVALS if self.remembered else 0
+        self._last_rate = None
+        self._last_bytes = None
+        self._last_time = None
+        CONNECTIONS_GAUGE.set(self.connections, host=self.host)
+
+    def reset(self, downloaded):
+        self._last_bytes = downloaded
+        self._last_time = time.monotonic()
+
+    def throttled(self):
+        self._throttled = True
+
+    def _change(self, connections, reason, rate):
+        previous, self.connections = self.connections, connections
+        CONNECTIONS_GAUGE.set(connections, host=self.host)
+        event("connections", connections=connections, previous=previous, reason=reason,
+              mb_s=round(rate / (1024 * 1024), 2))
+
+    def sample(self, downloaded):
+        """Feed the byte counter; returns True when the count changed."""
+        now = time.monotonic()
+        elapsed = now - self._last_time
+        if elapsed <= 0:
+            return False
+        rate = max(0, downloaded - self._last_bytes) / elapsed
+        self._last_bytes, self._last_time = downloaded, now
+        previous = self.connections
+
+        throttled, self._throttled = self._throttled, False
+        draining, self._draining = self._draining, False
+        if throttled and not draining:
+            self._probing = False
+            self._draining = True
+            self._hold = HOLD_INTERVALS
+            self.ceiling = max(1, self.connections - 1)
+            self._change(max(1, self.connections // 2), "throttled", rate)
+            print(f"⚠️ {self.host} is throttling, dropping to {self.connections} connections")
+        elif self._probing:
+            self._probing = False
+            per_connection = self._last_rate / (self.connections - 1)
+            if rate - self._last_rate < per_connection * MIN_MARGINAL_GAIN:
+                self._hold = HOLD_INTERVALS
+                self._change(self.connections - 1, "saturated", rate)
+        elif self._hold:
+            self._hold -= 1
+        elif self.connections < self.ceiling and rate > 0:
+            self._probing = True
+            self._change(self.connections + 1, "probe", rate)
+
+        if rate > self.best_rate and previous <= self.ceiling:
+            self.best_rate, self.best_connections = rate, previous
+        self._last_rate = rate
+        return self.connections != previous
+
+    def save(self):
+        if self.best_rate:
+            tuning_table.remember(self.host, min(self.best_connections, self.ceiling), self.best_rate)
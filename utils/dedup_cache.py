@@ -0,0 +1,65 @@
+import time
+import sqlite3
+from config import DEDUP_DB
+
+
+def content_key(crc, size):
+    return f"crc32:{crc:08x}:{size}"
+
+
+def dropbox_content_key(content_hash):
+    return f"dropbox:{content_hash}"
+
+
+def media_file_id(message):
+    for attr in ('photo', 'video', 'animation', 'audio', 'document'):
+        media = getattr(message, attr, None)
+        if media:
+            return attr, media.file_id
+    return None, None
+
+
+class DedupCache:
+    """Maps file content to the Telegram upload already made for it in each
+    chat. file_ids only work for the bot that uploaded them, so the bot's
+    session name is stored alongside."""
+
+    def __init__(self, path=DEDUP_DB):
+        self.path = path
+        self._db = None
+
+    def _conn(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                "chat_id INTEGER NOT NULL, content_key TEXT NOT NULL, file_id TEXT NOT NULL, "
+                "media_type TEXT, bot TEXT, message_id INTEGER, name TEXT, created REAL, "
+                "PRIMARY KEY (chat_id, content_key))"
+            )
+            self._db.commit()
+        return self._db
+
+    def lookup(self, chat_id, key):
+        row = self._conn().execute(
+            "SELECT file_id, media_type, bot, message_id, name FROM uploads WHERE chat_id = ? AND content_key = ?",
+            (chat_id, key)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('file_id', 'media_type', 'bot', 'message_id', 'name'), row))
+
+    def store(self, chat_id, key, message, bot, name):
+        media_type, file_id = media_file_id(message)
+        if not file_id:
+            return
+        db = self._conn()
+        db.execute(
+            "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (chat_id, key, file_id, media_type, bot, message.id, name, time.time())
+        )
+        db.commit()
+
+
+dedup_cache = DedupCache()
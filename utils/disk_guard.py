@@ -0,0 +1,56 @@
+import shutil
+import asyncio
+from config import DISK_RESERVE_MB, IMAGE_WORKERS, UPLOAD_WORKERS
+from utils.pipeline import PIPELINE_QUEUE_SIZE
+from utils.zip_helper import EXTRACT_LOOKAHEAD
+
+# Extracted files a job can hold at once: the three stage queues, the files
+# being converted and uploaded, and what parallel extraction writes ahead of
+# the pipeline before it blocks
+IN_FLIGHT_FILES = PIPELINE_QUEUE_SIZE * 3 + IMAGE_WORKERS + UPLOAD_WORKERS + EXTRACT_LOOKAHEAD
+
+
+def estimate_peak(archive_size, member_sizes):
+    """Worst-case bytes a job holds on disk at once: the archive (if it is
+    kept on disk), the largest files that can be in flight, and one more
+    copy of the largest for split parts or a transcode."""
+    largest = sorted(member_sizes, reverse=True)
+    return archive_size + sum(largest[:IN_FLIGHT_FILES]) + (largest[0] if largest else 0)
+
+
+class DiskGuard:
+    """Admits jobs only when the volume has room for their estimated peak,
+    counting space already promised to running jobs."""
+
+    def __init__(self, path=".", reserve=DISK_RESERVE_MB * 1024 * 1024):
+        self.path = path
+        self.reserve = reserve
+        self.reserved = {}
+        self._changed = asyncio.Condition()
+
+    def free_space(self):
+        return shutil.disk_usage(self.path).free
+
+    def _available(self, key):
+        others = sum(size for owner, size in self.reserved.items() if owner != key)
+        return self.free_space() - self.reserve - others
+
+    async def admit(self, key, needed):
+        """Reserve `needed` bytes for `key`. Waits while other jobs hold the
+        space; returns False if the job can never fit."""
+        async with self._changed:
+            while True:
+                if self._available(key) >= needed:
+                    self.reserved[key] = needed
+                    return True
+                if not any(owner != key for owner in self.reserved):
+                    return False
+                await self._changed.wait()
+
+    async def release(self, key):
+        async with self._changed:
+            self.reserved.pop(key, None)
+            self._changed.notify_all()
+
+
+disk_guard = DiskGuard()
@@ -1,45 +1,87 @@
 import asyncio
 import os
+import json
 import time
 import aiohttp
 import aerofs
 import zipfile
 from utils.progress import Progress
 from utils.user_agents import get_random_user_agent
+from utils.metrics import DOWNLOAD_BYTES, DOWNLOAD_THROTTLED
+from utils.tracer import span, event
+from utils.connection_tuner import ConnectionTuner, TUNE_INTERVAL
+from config import DOWNLOAD_MAX_CONNECTIONS
+
+RANGE_SIZE = 8 * 1024 * 1024
+RANGE_RETRIES = 5
+# Single-stream GETs stay open for the whole archive, and pipeline backpressure
+# can hold them for hours, so only connecting and stalled reads time out
+STREAM_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+# Responses Dropbox sends when a link gets more parallel requests than it allows
+THROTTLE_STATUSES = (403, 429, 503)
+# Responses to a redirect URL that has expired; the shared link is probed
+# again for a fresh one
+EXPIRED_STATUSES = (403, 410)
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class Throttled(Exception):
+    def __init__(self, message, retry_after=0, status=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+
+
+class UrlExpired(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
 
 class SmartDownloader:
-    def __init__(self, url, dest_path, progress_callback=None, concurrency=4, chunk_size=1024*1024):
+    def __init__(self, url, dest_path, progress_callback=None, concurrency=None, chunk_size=1024*1024):
         self.url = url
         self.dest_path = dest_path
         self.progress_callback = progress_callback
+        # None lets the tuner start from what worked for this host before
         self.concurrency = concurrency
         self.chunk_size = chunk_size
         self.total_size = 0
         self.downloaded = 0
-        self.process = None
+        self.etag = None
+        self.state_path = f"{dest_path}.ranges"
         self._lock = asyncio.Lock()
 
     async def initialize(self):
         pass
 
     async def close(self):
-        if self.process and self.process.returncode is None:
-            try:
-                self.process.terminate()
-                await self.process.wait()
-            except ProcessLookupError:
-                pass
+        pass
 
     async def download(self):
         try:
-            await self._download_aria2c()
-            self._validate_download()
+            await self._download_ranged()
+            with span("validate"):
+                self._validate_download()
+        except RangeNotSupported as e:
+            print(f"⚠️ Ranged download unavailable ({e}), falling back to single stream...")
+            await self._download_aiohttp()
+            with span("validate"):
+                self._validate_download()
         except Exception as e:
             error_msg = str(e)
-            if "403" in error_msg or "errorCode=22" in error_msg or "not a zip file" in error_msg.lower():
-                print(f"⚠️ Aria2c failed ({error_msg[:50]}...), falling back to aiohttp...")
+            # Once ranges are on disk a 403 is not a refusal of ranged
+            # requests; the state is kept so a resume fetches only the rest
+            refused = "403" in error_msg and not os.path.exists(self.state_path)
+            if refused or "not a valid zip file" in error_msg.lower():
+                print(f"⚠️ Ranged download failed ({error_msg[:50]}...), falling back to single stream...")
+                self._clear_state()
                 await self._download_aiohttp()
-                self._validate_download()
+                with span("validate"):
+                    self._validate_download()
             else:
                 raise
     
@@ -59,146 +101,300 @@ class SmartDownloader:
                 _ = zf.namelist()
         except zipfile.BadZipFile:
             raise Exception("Downloaded file is not a valid ZIP file. The link may be expired or invalid.")
-    
-    async def _download_aria2c(self):
+
+    async def _probe(self, session):
+        # A one-byte range request tells us the size, the ETag, whether ranges
+        # are honoured and where Dropbox redirects, all in one round trip
+        headers = self._request_headers()
+        headers['Range'] = 'bytes=0-0'
+        async with session.get(self.url, headers=headers) as response:
+            total_size = 0
+            if response.status == 206:
+                content_range = response.headers.get('Content-Range', '')
+                if '/' in content_range and not content_range.endswith('/*'):
+                    total_size = int(content_range.rsplit('/', 1)[1])
+                await response.read()
+            elif response.status == 200:
+                total_size = int(response.headers.get('Content-Length', 0))
+            return response.status, total_size, response.headers.get('ETag'), str(response.url)
+
+    async def probe(self):
+        """Size and ETag of the remote file, without downloading it."""
+        async with aiohttp.ClientSession() as session:
+            status, total_size, etag, _ = await self._probe(session)
+        if status not in (200, 206):
+            raise Exception(f"HTTP error {status}")
+        return total_size, etag
+
+    async def fetch_tail(self, length):
+        """Last `length` bytes of the remote file (the whole file if shorter)."""
+        headers = self._request_headers()
+        headers['Range'] = f'bytes=-{length}'
+        async with aiohttp.ClientSession() as session:
+            async with session.get(self.url, headers=headers) as response:
+                if response.status != 206:
+                    raise RangeNotSupported(f"HTTP {response.status} to a range request")
+                return await response.read()
+
+    async def _probe_ranges(self, session):
+        status, total_size, etag, url = await self._probe(session)
+        if status != 206:
+            raise RangeNotSupported(f"HTTP {status} to a range request")
+        if not total_size:
+            raise RangeNotSupported("no total size in Content-Range")
+        return total_size, etag, url
+
+    def _load_state(self, range_count):
+        # Completed ranges survive crashes in a small sidecar bitmap, so a
+        # resumed download only fetches what is still missing
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            if (state['total'] == self.total_size and state['etag'] == self.etag
+                    and state['range_size'] == RANGE_SIZE
+                    and os.path.getsize(self.dest_path) == self.total_size):
+                done = bytearray(bytes.fromhex(state['done']))
+                if len(done) == range_count:
+                    return done
+        except (OSError, ValueError, KeyError):
+            pass
+        return bytearray(range_count)
+
+    def _save_state(self, done):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'url': self.url,
+                'total': self.total_size,
+                'etag': self.etag,
+                'range_size': RANGE_SIZE,
+                'done': done.hex(),
+            }, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _clear_state(self):
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+
+    async def _fetch_range(self, session, url, index):
+        start = index * RANGE_SIZE
+        end = min(start + RANGE_SIZE, self.total_size) - 1
+        headers = self._request_headers()
+        headers['Range'] = f'bytes={start}-{end}'
+        received = 0
+
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status in THROTTLE_STATUSES:
+                    DOWNLOAD_THROTTLED.inc(status=response.status)
+                    retry_after = response.headers.get('Retry-After', '')
+                    raise Throttled(
+                        f"HTTP error {response.status} for range {start}-{end}",
+                        int(retry_after) if retry_after.isdigit() else 0,
+                        response.status,
+                    )
+                if response.status in EXPIRED_STATUSES:
+                    raise UrlExpired(f"HTTP error {response.status} for range {start}-{end}", response.status)
+                if response.status != 206:
+                    raise Exception(f"HTTP error {response.status} for range {start}-{end}")
+                if not response.headers.get('Content-Range', '').startswith(f'bytes {start}-'):
+                    raise Exception(f"Server returned the wrong range for {start}-{end}")
+
+                async with aerofs.open(self.dest_path, 'r+b') as f:
+                    await f.seek(start)
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        await f.write(chunk)
+                        received += len(chunk)
+                        self.downloaded += len(chunk)
+                        DOWNLOAD_BYTES.inc(len(chunk), method="ranged")
+                        if self.progress_callback:
+                            await self.progress_callback(self.downloaded, self.total_size)
+
+            if received != end - start + 1:
+                raise Exception(f"Short read for range {start}-{end}")
+        except BaseException:
+            # Only the bytes of this range are lost; it goes back on the queue
+            self.downloaded -= received
+            raise
+
+    async def _download_ranged(self):
         start_time = time.time()
-        
-        user_agent = get_random_user_agent()
-        
-        cmd = [
-            "aria2c",
-            "--max-connection-per-server", str(self.concurrency),
-            "--split", str(self.concurrency),
-            "--min-split-size", "1M",
-            "--out", os.path.basename(self.dest_path),
-            "--dir", os.path.dirname(self.dest_path) or ".",
-            "--file-allocation=none",
-            "--summary-interval=1",
-            "--console-log-level=warn",
-            "--max-tries=5",
-            "--retry-wait=3",
-            "--timeout=60",
-            "--connect-timeout=30",
-            "--max-file-not-found=5",
-            "--allow-overwrite=true",
-            "--auto-file-renaming=false",
-            "--continue=true",
-            f"--user-agent={user_agent}",
-            f"--header=Accept: */*",
-            f"--header=Accept-Language: en-US,en;q=0.9",
-            f"--header=Accept-Encoding: gzip, deflate, br",
-            f"--header=Connection: keep-alive",
-            f"--header=Upgrade-Insecure-Requests: 1",
-            f"--referer=https://www.dropbox.com/",
-            self.url
-        ]
-        
-        print(f"Starting aria2c download with enhanced headers...")
-        
-        self.process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        stdout_lines = []
-        stderr_lines = []
-        
-        async def read_stderr():
-            while True:
-                line = await self.process.stderr.readline()
-                if not line:
-                    break
-                stderr_lines.append(line.decode('utf-8').strip())
-        
-        stderr_task = asyncio.create_task(read_stderr())
-        
-        while True:
-            line = await self.process.stdout.readline()
-            if not line:
-                break
-                
-            line = line.decode('utf-8').strip()
-            if line:
-                stdout_lines.append(line)
-                if line.startswith("[#") and "/" in line and "(" in line:
+        tuner = ConnectionTuner(self.url, self.concurrency)
+        connector = aiohttp.TCPConnector(limit=DOWNLOAD_MAX_CONNECTIONS)
+
+        async with aiohttp.ClientSession(connector=connector) as session:
+            self.total_size, self.etag, range_url = await self._probe_ranges(session)
+            range_count = -(-self.total_size // RANGE_SIZE)
+
+            if not os.path.exists(self.dest_path) or os.path.getsize(self.dest_path) != self.total_size:
+                self._clear_state()
+                with open(self.dest_path, 'wb') as f:
+                    f.truncate(self.total_size)
+
+            done = self._load_state(range_count)
+            self.downloaded = sum(
+                min(RANGE_SIZE, self.total_size - i * RANGE_SIZE) for i in range(range_count) if done[i]
+            )
+            if self.downloaded:
+                print(f"Resuming ranged download at {self.downloaded / (1024 * 1024):.1f} MB")
+
+            # Workers steal small ranges from a shared queue, so a slow or
+            # dropped connection only holds up the range it is working on
+            queue = asyncio.Queue()
+            for index in range(range_count):
+                if not done[index]:
+                    queue.put_nowait(index)
+            attempts = {}
+            refresh_lock = asyncio.Lock()
+
+            async def refresh(stale_url):
+                # Dropbox's redirect URLs expire during long downloads. One
+                # worker probes the shared link again; the others find the
+                # new URL already in place. Returns True if the URL changed.
+                nonlocal range_url
+                async with refresh_lock:
+                    if range_url != stale_url:
+                        return True
+                    total_size, etag, url = await self._probe_ranges(session)
+                    if total_size != self.total_size or (etag and self.etag and etag != self.etag):
+                        raise Exception("Remote file changed during the download")
+                    range_url = url
+                    event("url_refresh", changed=url != stale_url)
+                    return url != stale_url
+
+            async def fetch(index):
+                while True:
+                    url = range_url
                     try:
-                        parts = line.split()
-                        for part in parts:
-                            if "/" in part and "(" in part:
-                                size_part = part.split("(")[0]
-                                current_str, total_str = size_part.split("/")
-                                
-                                def parse_aria_size(s):
-                                    s = s.upper()
-                                    if s.endswith('KIB'): return float(s[:-3]) * 1024
-                                    if s.endswith('MIB'): return float(s[:-3]) * 1024**2
-                                    if s.endswith('GIB'): return float(s[:-3]) * 1024**3
-                                    if s.endswith('TIB'): return float(s[:-3]) * 1024**4
-                                    if s.endswith('B'): return float(s[:-1])
-                                    return 0.0
-
-                                current = parse_aria_size(current_str)
-                                total = parse_aria_size(total_str)
-                                
-                                if self.progress_callback and total > 0:
-                                    await self.progress_callback(current, total)
-                    except Exception:
-                        pass
-            
-            if self.process.stdout.at_eof():
-                break
-
-        await self.process.wait()
-        await stderr_task
-        
-        if self.process.returncode != 0:
-            stderr_output = '\n'.join(stderr_lines[-20:]) if stderr_lines else "No error output"
-            stdout_output = '\n'.join(stdout_lines[-20:]) if stdout_lines else "No stdout output"
-            error_msg = f"Aria2c failed with code {self.process.returncode}"
-            
-            if self.process.returncode == 22:
-                error_msg += "\nHTTP or URL error - Possible causes:"
-                error_msg += "\n- Server rejected the request (403/404/429)"
-                error_msg += "\n- Invalid or expired download link"
-                error_msg += "\n- Malformed URL or unsupported protocol"
-                error_msg += "\n- Network connectivity issues"
-            
-            error_msg += f"\n\nURL: {self.url}"
-            error_msg += f"\n\nRecent stdout output:\n{stdout_output}"
-            error_msg += f"\n\nRecent stderr output:\n{stderr_output}"
-            raise Exception(error_msg)
-            
-        if os.path.exists(self.dest_path):
-            self.total_size = os.path.getsize(self.dest_path)
-            self.downloaded = self.total_size
-            if self.progress_callback:
-                await self.progress_callback(self.total_size, self.total_size)
-        else:
-            raise Exception("Download finished but file not found")
+                        await self._fetch_range(session, url, index)
+                        return
+                    except Exception as e:
+                        attempts[index] = attempts.get(index, 0) + 1
+                        event("range_retry", range=index, attempt=attempts[index], error=str(e)[:200])
+                        if attempts[index] >= RANGE_RETRIES:
+                            raise Exception(f"Range {index} failed after {RANGE_RETRIES} attempts: {e}")
+                        if getattr(e, 'status', None) in EXPIRED_STATUSES and await refresh(url):
+                            # The old URL had expired, which says nothing
+                            # about throttling; retry at once on the new one
+                            continue
+                        backoff = min(2 ** attempts[index], 30)
+                        if isinstance(e, Throttled):
+                            tuner.throttled()
+                            backoff = max(backoff, min(e.retry_after, 60))
+                        await asyncio.sleep(backoff)
+
+            async def worker(slot):
+                # Workers above the tuner's count finish their range and leave.
+                # A failed range is retried by the worker holding it, so a
+                # shrinking pool never strands it in the queue.
+                while slot < tuner.connections:
+                    try:
+                        index = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    await fetch(index)
+                    done[index] = 1
+                    self._save_state(done)
+
+            workers = {}
+
+            def spawn():
+                for slot in range(tuner.connections):
+                    if slot not in workers or workers[slot].done():
+                        workers[slot] = asyncio.create_task(worker(slot))
+
+            source = "remembered" if tuner.remembered else "initial"
+            print(f"Starting ranged download ({tuner.connections} {source} connections, {range_count} ranges)...")
+            tuner.reset(self.downloaded)
+            spawn()
+            try:
+                while True:
+                    running = [task for task in workers.values() if not task.done()]
+                    if not running:
+                        if queue.empty():
+                            break
+                        spawn()
+                        continue
+                    finished, _ = await asyncio.wait(
+                        running, timeout=TUNE_INTERVAL, return_when=asyncio.FIRST_EXCEPTION
+                    )
+                    for task in finished:
+                        task.result()
+                    if queue.empty():
+                        # The tail of the download cannot keep every connection busy
+                        tuner.reset(self.downloaded)
+                    elif tuner.sample(self.downloaded):
+                        spawn()
+            finally:
+                for task in workers.values():
+                    task.cancel()
+                tuner.save()
+
+        missing = range_count - sum(done)
+        if missing:
+            # Keep the state file so a resume fetches only what is missing
+            raise Exception(f"Ranged download incomplete: {missing} of {range_count} ranges missing")
+
+        self._clear_state()
+        if self.progress_callback:
+            await self.progress_callback(self.total_size, self.total_size)
 
         download_time = time.time() - start_time
         speed = (self.total_size / (1024 * 1024)) / download_time if download_time > 0 else 0
-        print(f"Aria2c download completed in {download_time:.2f}s ({speed:.2f} MB/s)")
-        
+        print(f"Ranged download completed in {download_time:.2f}s ({speed:.2f} MB/s, "
+              f"best with {tuner.best_connections} connections)")
+
         return self.dest_path
-    
-    async def _download_aiohttp(self):
-        start_time = time.time()
-        user_agent = get_random_user_agent()
-        
-        headers = {
-            'User-Agent': user_agent,
+
+    def _request_headers(self):
+        return {
+            'User-Agent': get_random_user_agent(),
             'Accept': '*/*',
             'Accept-Language': 'en-US,en;q=0.9',
             'Accept-Encoding': 'identity',
             'Connection': 'keep-alive',
             'Referer': 'https://www.dropbox.com/',
         }
+
+    async def download_stream(self, consumer):
+        """Single-stream GET that hands every chunk to `consumer.feed()`
+        instead of writing the archive to disk."""
+        start_time = time.time()
+        headers = self._request_headers()
+
+        print(f"Starting streaming download (extracting on the fly)...")
+
+        async with aiohttp.ClientSession(timeout=STREAM_TIMEOUT) as session:
+            async with session.get(self.url, headers=headers) as response:
+                if response.status != 200:
+                    raise Exception(f"HTTP error {response.status}: {response.reason}")
+
+                self.total_size = int(response.headers.get('Content-Length', 0))
+                self.downloaded = 0
+
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    await consumer.feed(chunk)
+                    self.downloaded += len(chunk)
+                    DOWNLOAD_BYTES.inc(len(chunk), method="stream")
+
+                    if self.progress_callback:
+                        await self.progress_callback(self.downloaded, self.total_size)
+
+        await consumer.finish()
+
+        download_time = time.time() - start_time
+        speed = (self.downloaded / (1024 * 1024)) / download_time if download_time > 0 else 0
+        print(f"Streaming download completed in {download_time:.2f}s ({speed:.2f} MB/s)")
+
+    async def _download_aiohttp(self):
+        start_time = time.time()
+        headers = self._request_headers()
         
         print(f"Starting aiohttp download (single stream, Dropbox-friendly)...")
         
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(timeout=STREAM_TIMEOUT) as session:
             async with session.get(self.url, headers=headers) as response:
                 if response.status != 200:
                     raise Exception(f"HTTP error {response.status}: {response.reason}")
@@ -210,6 +406,7 @@ class SmartDownloader:
                     async for chunk in response.content.iter_chunked(self.chunk_size):
                         await f.write(chunk)
                         self.downloaded += len(chunk)
+                        DOWNLOAD_BYTES.inc(len(chunk), method="single")
                         
                         if self.progress_callback and self.total_size > 0:
                             await self.progress_callback(self.downloaded, self.total_size)
@@ -0,0 +1,172 @@
+import os
+import math
+import shutil
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+import pillow_heif
+from config import IMAGE_WORKERS
+from utils.metrics import IMAGE_SECONDS
+
+# Registered at import time so pool processes can open HEIC files too
+pillow_heif.register_heif_opener()
+
+# Panoramas above Pillow's default bomb limit are legitimate here; JPEGs are
+# draft-decoded at reduced size, so only keep a guard against absurd headers
+Image.MAX_IMAGE_PIXELS = 1_000_000_000
+
+IMAGE_QUALITY = 85
+
+process_executor = None
+_job_slots = None
+
+def _compress_image(input_path: str, output_path: str, max_quality: int = IMAGE_QUALITY) -> bool:
+    try:
+        img = Image.open(input_path)
+        exif_data = img.info.get('exif', None)
+        
+        if img.mode in ('RGBA', 'LA', 'P'):
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            if img.mode == 'P':
+                img = img.convert('RGBA')
+            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+            img = background
+        
+        file_size = os.path.getsize(input_path)
+        
+        if file_size < 500 * 1024:
+            img.save(output_path, 'PNG', optimize=True)
+        else:
+            save_params = {
+                'format': 'JPEG',
+                'quality': max_quality,
+                'optimize': True,
+                'progressive': True,
+                'subsampling': 0,
+            }
+            if exif_data:
+                save_params['exif'] = exif_data
+            img.save(output_path, **save_params)
+        
+        if os.path.exists(output_path):
+            original_size = os.path.getsize(input_path)
+            compressed_size = os.path.getsize(output_path)
+            if compressed_size >= original_size * 0.95:
+                shutil.copy2(input_path, output_path)
+            return True
+        return False
+    except Exception as e:
+        print(f"Image compression error: {e}")
+        try:
+            shutil.copy2(input_path, output_path)
+            return True
+        except:
+            return False
+
+def _telegram_scale(width, height):
+    MAX_SIDE = 10000
+    MAX_PIXELS = 40_000_000
+    scale = 1.0
+
+    if width > MAX_SIDE or height > MAX_SIDE:
+        scale = min(scale, MAX_SIDE / float(max(width, height)))
+
+    if width * height > MAX_PIXELS:
+        pixel_scale = (MAX_PIXELS / float(width * height)) ** 0.5
+        if pixel_scale < scale:
+            scale = pixel_scale
+
+    return scale
+
+def _prepare_photo(input_path: str, quality: int = 95):
+    """Decode once, apply EXIF rotation, alpha flattening and Telegram's
+    dimension limits in memory, then encode a single JPEG. Returns the input
+    path when nothing had to change, or None when a HEIF source can't be
+    converted."""
+    is_heif = os.path.splitext(input_path)[1].lower() in ('.heic', '.heif')
+    try:
+        img = Image.open(input_path)
+        width, height = img.size
+        if width <= 0 or height <= 0:
+            return None if is_heif else input_path
+
+        # Image.open only parses headers, so the size is known before decoding
+        scale = _telegram_scale(width, height)
+        if scale >= 1.0 and not is_heif:
+            return input_path
+
+        if scale < 1.0 and img.format == 'JPEG':
+            # Let libjpeg downscale by 1/2, 1/4 or 1/8 while decoding so the
+            # full-resolution bitmap is never built. draft() never goes below
+            # the size asked for, so the target keeps every pixel Telegram
+            # accepts; LANCZOS does whatever remains
+            img.draft(img.mode, (math.ceil(width * scale), math.ceil(height * scale)))
+
+        try:
+            # exif_transpose copies the bitmap even when there is nothing to do
+            if img.getexif().get(0x0112, 1) != 1:
+                img = ImageOps.exif_transpose(img)
+        except Exception:
+            pass
+        exif_data = img.info.get('exif', None)
+
+        if img.mode in ('RGBA', 'LA', 'P'):
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            if img.mode == 'P':
+                img = img.convert('RGBA')
+            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+            img = background
+        elif img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        width, height = img.size
+        scale = _telegram_scale(width, height)
+        if scale < 1.0:
+            img = img.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+
+        output_path = f"{input_path}_tg.jpg"
+
+        save_params = {
+            'format': 'JPEG',
+            'quality': quality,
+            'optimize': True,
+            'progressive': True,
+            'subsampling': 0,
+        }
+        if exif_data:
+            save_params['exif'] = exif_data
+        img.save(output_path, **save_params)
+
+        if os.path.exists(output_path):
+            return output_path
+        return None if is_heif else input_path
+    except Exception as e:
+        print(f"Photo prepare error: {e}")
+        return None if is_heif else input_path
+
+def _get_process_executor():
+    global process_executor
+    if process_executor is None:
+        process_executor = ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return process_executor
+
+async def _run_in_pool(func, *args):
+    # Pillow decode/encode and resampling are CPU-bound, so they run in worker
+    # processes; the semaphore keeps queued jobs (and their memory) bounded
+    global _job_slots
+    if _job_slots is None:
+        _job_slots = asyncio.Semaphore(IMAGE_WORKERS * 2)
+    async with _job_slots:
+        loop = asyncio.get_running_loop()
+        with IMAGE_SECONDS.time(operation=func.__name__.lstrip('_')):
+            return await loop.run_in_executor(_get_process_executor(), func, *args)
+
+async def compress_image(input_path: str, output_path: str, max_quality: int = IMAGE_QUALITY) -> bool:
+    return await _run_in_pool(_compress_image, input_path, output_path, max_quality)
+
+async def prepare_photo(input_path: str, quality: int = 95):
+    return await _run_in_pool(_prepare_photo, input_path, quality)
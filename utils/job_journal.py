@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+JOBS_DIR = "jobs"
+# Byte counters change constantly; the journal is rewritten at most this often
+# for them, while uploads and extracted members are written immediately
+SAVE_INTERVAL = 5.0
+# Query parameters that change between copies of the same shared link
+VOLATILE_PARAMS = {'dl', 'raw', 'e', 'st'}
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in VOLATILE_PARAMS
+    )
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ''))
+
+
+def job_key(url: str) -> str:
+    return hashlib.sha1(normalize_url(url).encode()).hexdigest()[:16]
+
+
+class JobJournal:
+    """Checkpoint of one backup job, kept in `jobs/<key>/journal.json` next to
+    the job's working files so a restarted bot can pick the job up again.
+
+    Per-member updates are appended to `journal.log` instead of rewriting the
+    whole checkpoint; the log is replayed on load and folded into
+    journal.json by the next full save."""
+
+    def __init__(self, key, data):
+        self.key = key
+        self.data = data
+        self.data['extracted'] = set(data['extracted'])
+        self.work_dir = os.path.join(JOBS_DIR, key)
+        self.path = os.path.join(self.work_dir, "journal.json")
+        self.log_path = os.path.join(self.work_dir, "journal.log")
+        self._log = None
+        self._saved_at = 0
+
+    @property
+    def resumed(self):
+        return bool(self.data['extracted'] or self.data['uploaded'] or self.data['downloaded_bytes'])
+
+    def save(self):
+        self.data['updated'] = time.time()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({**self.data, 'extracted': sorted(self.data['extracted'])}, f)
+        os.replace(tmp_path, self.path)
+        # Everything in the log is now in journal.json
+        self.close()
+        try:
+            os.remove(self.log_path)
+        except OSError:
+            pass
+        self._saved_at = time.monotonic()
+
+    def _append(self, record):
+        if self._log is None:
+            self._log = open(self.log_path, 'a', encoding='utf-8')
+        self._log.write(json.dumps(record) + "\n")
+        self._log.flush()
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def replay_log(self):
+        try:
+            with open(self.log_path, encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line may be cut short by a crash
+                continue
+            if record['kind'] == 'extracted':
+                self.data['extracted'].add(record['member'])
+            else:
+                self.data[record['kind']][record['member']] = record['message_ids']
+
+    def matches_remote(self, total_size, etag):
+        # A link that now serves a different file must not reuse old progress
+        if self.data['etag'] and etag and self.data['etag'] != etag:
+            return False
+        if self.data['total_size'] and total_size and self.data['total_size'] != total_size:
+            return False
+        return True
+
+    def set_remote(self, total_size, etag):
+        self.data['total_size'] = total_size
+        self.data['etag'] = etag
+        self.save()
+
+    def set_status_message(self, chat_id, message_id):
+        self.data['status_chat_id'] = chat_id
+        self.data['status_message_id'] = message_id
+        self.save()
+
+    def set_downloaded(self, downloaded):
+        self.data['downloaded_bytes'] = downloaded
+        if time.monotonic() - self._saved_at >= SAVE_INTERVAL:
+            self.save()
+
+    def mark_downloaded(self):
+        self.data['download_complete'] = True
+        self.save()
+
+    def mark_extraction_complete(self):
+        self.data['extraction_complete'] = True
+        self.save()
+
+    def mark_extracted(self, member):
+        if member not in self.data['extracted']:
+            self.data['extracted'].add(member)
+            self._append({'kind': 'extracted', 'member': member})
+
+    def mark_uploaded(self, member, message_ids):
+        self.data['uploaded'][member] = message_ids
+        self._append({'kind': 'uploaded', 'member': member, 'message_ids': message_ids})
+
+    def mark_part_uploaded(self, part, message_ids):
+        self.data['uploaded_parts'][part] = message_ids
+        self._append({'kind': 'uploaded_parts', 'member': part, 'message_ids': message_ids})
+
+    def is_uploaded(self, member):
+        return member in self.data['uploaded']
+
+    def is_part_uploaded(self, part):
+        return part in self.data['uploaded_parts']
+
+    def reset(self):
+        """Drop all progress and working files but keep the job itself."""
+        keep = {name: self.data[name] for name in ('url', 'user_id', 'dump_channel', 'media_types', 'source',
+                                                   'status_chat_id', 'status_message_id', 'created')}
+        self.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.data = JournalStore.new_data(**keep)
+        self.data['extracted'] = set()
+        self.save()
+
+
+class JournalStore:
+    def __init__(self, root=JOBS_DIR):
+        self.root = root
+        self.active = set()
+
+    @staticmethod
+    def new_data(url, user_id, dump_channel, media_types, source='zip', status_chat_id=None,
+                 status_message_id=None, created=None):
+        return {
+            'url': url,
+            'user_id': user_id,
+            'dump_channel': dump_channel,
+            'media_types': sorted(media_types),
+            'source': source,
+            'status_chat_id': status_chat_id,
+            'status_message_id': status_message_id,
+            'created': created or time.time(),
+            'updated': time.time(),
+            'etag': None,
+            'total_size': 0,
+            'downloaded_bytes': 0,
+            'download_complete': False,
+            'extraction_complete': False,
+            'extracted': [],
+            'uploaded': {},
+            'uploaded_parts': {},
+        }
+
+    def _load(self, key):
+        path = os.path.join(self.root, key, "journal.json")
+        try:
+            with open(path, 'r') as f:
+                journal = JobJournal(key, json.load(f))
+        except (OSError, ValueError):
+            return None
+        journal.replay_log()
+        return journal
+
+    def open(self, url, user_id, dump_channel, media_types, source='zip'):
+        """Existing journal for this link, or a fresh one. Returns None if a
+        job for the same link is already running."""
+        key = job_key(url)
+        if key in self.active:
+            return None
+        journal = self._load(key)
+        if journal is None:
+            journal = JobJournal(key, self.new_data(url, user_id, dump_channel, media_types, source))
+            os.makedirs(journal.work_dir, exist_ok=True)
+        else:
+            journal.data.update(user_id=user_id, dump_channel=dump_channel, media_types=sorted(media_types),
+                                source=source)
+        journal.save()
+        self.active.add(key)
+        return journal
+
+    def pending(self):
+        """Journals left behind by a previous run that did not finish."""
+        if not os.path.isdir(self.root):
+            return []
+        journals = []
+        for key in sorted(os.listdir(self.root)):
+            if key in self.active:
+                continue
+            journal = self._load(key)
+            if journal is not None:
+                journals.append(journal)
+        return journals
+
+    def release(self, journal):
+        journal.close()
+        self.active.discard(journal.key)
+
+    def remove(self, journal):
+        self.release(journal)
+        shutil.rmtree(journal.work_dir, ignore_errors=True)
+
+
+journal_store = JournalStore()
@@ -0,0 +1,175 @@
+import time
+import bisect
+import threading
+from aiohttp import web
+from config import METRICS_HOST, METRICS_PORT
+
+# Every metric registers itself here when it is created
+registry = []
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        # Extraction callbacks run in worker threads
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _samples(self):
+        with self._lock:
+            return list(self.values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self._samples():
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Set directly, or pass `function` returning {label values tuple: value}
+    to compute the gauge when it is scraped."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+    def _samples(self):
+        if self.function is not None:
+            return list(self.function().items())
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in self._samples():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+DOWNLOAD_BYTES = Counter(
+    "dropbox_download_bytes_total", "Bytes downloaded from Dropbox", ["method"])
+EXTRACT_BYTES = Counter(
+    "extract_bytes_total", "Bytes of archive members written to disk", ["mode"])
+EXTRACT_FILES = Counter(
+    "extract_files_total", "Archive members written to disk", ["mode"])
+DOWNLOAD_CONNECTIONS = Gauge(
+    "dropbox_download_connections", "Connections the tuner uses for ranged downloads", ["host"])
+DOWNLOAD_THROTTLED = Counter(
+    "dropbox_download_throttled_total", "Range requests refused with a throttling status", ["status"])
+IMAGE_SECONDS = Histogram(
+    "image_convert_seconds", "Time spent converting one image in a worker process", ["operation"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+FFMPEG_SECONDS = Histogram(
+    "ffmpeg_seconds", "Wall time of one ffmpeg run", ["operation"],
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 3600))
+UPLOAD_SECONDS = Histogram(
+    "upload_call_seconds", "Latency of one Telegram upload call", ["outcome"])
+UPLOAD_BYTES = Counter(
+    "upload_bytes_total", "Bytes uploaded to Telegram")
+FLOODWAIT_SECONDS = Counter(
+    "floodwait_seconds_total", "Seconds Telegram asked us to wait", ["scope"])
+
+
+def render_metrics():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+_runner = None
+
+
+async def _handle_metrics(request):
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics in the Prometheus text format; disabled when port is 0."""
+    global _runner
+    if not port or _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    print(f"📈 Metrics available at http://{host}:{port}/metrics")
+
+
+async def stop_metrics_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
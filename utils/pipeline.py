@@ -0,0 +1,102 @@
+import asyncio
+import weakref
+from utils.metrics import Gauge
+
+PIPELINE_QUEUE_SIZE = 8
+
+_DONE = object()
+
+# Pipelines of the running jobs, for the queue depth gauge
+_active = weakref.WeakSet()
+
+
+def _queue_depths():
+    depths = {}
+    for pipeline in list(_active):
+        for stage in pipeline.stages:
+            key = (stage['name'],)
+            depths[key] = depths.get(key, 0) + stage['queue'].qsize()
+    return depths
+
+
+Gauge("pipeline_queue_depth", "Items waiting in front of each pipeline stage", ["stage"], function=_queue_depths)
+
+
+class Pipeline:
+    def __init__(self, maxsize=PIPELINE_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.stages = []
+        self.aborted = False
+        _active.add(self)
+
+    def add_stage(self, name, handler, workers=1, on_close=None):
+        """Append a stage. `handler(item)` returns the item for the next stage,
+        or None to drop it. `on_close()` runs once after the stage drains."""
+        self.stages.append({
+            'name': name,
+            'handler': handler,
+            'workers': workers,
+            'on_close': on_close,
+            'queue': asyncio.Queue(maxsize=self.maxsize),
+        })
+
+    async def put(self, item):
+        if self.aborted:
+            raise Exception("Pipeline aborted")
+        await self.stages[0]['queue'].put(item)
+
+    async def emit(self, stage_name, item):
+        """Push an item into the stage after `stage_name` (used by on_close
+        hooks and handlers that produce more than one item)."""
+        index = [s['name'] for s in self.stages].index(stage_name)
+        if index + 1 < len(self.stages):
+            await self.stages[index + 1]['queue'].put(item)
+
+    async def _worker(self, index):
+        stage = self.stages[index]
+        next_queue = self.stages[index + 1]['queue'] if index + 1 < len(self.stages) else None
+
+        while True:
+            item = await stage['queue'].get()
+            if item is _DONE:
+                await stage['queue'].put(_DONE)
+                return
+            result = await stage['handler'](item)
+            if result is not None and next_queue is not None:
+                await next_queue.put(result)
+
+    async def _run_stage(self, index):
+        stage = self.stages[index]
+        await asyncio.gather(*(self._worker(index) for _ in range(stage['workers'])))
+        if stage['on_close']:
+            await stage['on_close']()
+        if index + 1 < len(self.stages):
+            await self.stages[index + 1]['queue'].put(_DONE)
+
+    def _abort(self):
+        self.aborted = True
+        # Drain the head queue so a producer blocked on put() can observe the abort
+        queue = self.stages[0]['queue']
+        while not queue.empty():
+            queue.get_nowait()
+
+    async def run(self, source):
+        """Run `source` (a coroutine that feeds items through `put`) and all
+        stages concurrently until every item has passed the last stage."""
+        async def feed():
+            await source
+            await self.stages[0]['queue'].put(_DONE)
+
+        tasks = [asyncio.create_task(feed())]
+        tasks += [asyncio.create_task(self._run_stage(i)) for i in range(len(self.stages))]
+
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            self._abort()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            _active.discard(self)
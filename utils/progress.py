@@ -1,53 +1,115 @@
 import time
 import math
+from collections import deque
+from typing import NamedTuple, Optional
 from utils.system_stats import get_system_stats
 
+# Samples kept for the windowed speed, at most one per SAMPLE_SPACING seconds
+# (about 5s of history), and the weight of the newest rate in the EWMA
+WINDOW_SIZE = 10
+SAMPLE_SPACING = 0.5
+EWMA_ALPHA = 0.3
+
+
+class ProgressSnapshot(NamedTuple):
+    action: str
+    current: float
+    total: float
+    elapsed: float
+    speed: float          # over the sample window
+    ewma_speed: float     # smoothed rate between samples
+    average_speed: float  # over the whole stage
+    eta: Optional[float]  # seconds, None while the speed is unknown
+
+
+def human_readable_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024:
+            return f"{size:.2f} {unit}"
+        size /= 1024
+    return f"{size:.2f} PB"
+
+
+def format_duration(seconds):
+    if seconds is None or math.isinf(seconds):
+        return "--"
+    if seconds < 10:
+        return f"{seconds:.1f}s"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
 class Progress:
-    def __init__(self, message, total_size, action_name):
-        self.message = message
+    def __init__(self, reporter, total_size, action_name):
+        self.reporter = reporter
         self.total_size = total_size
         self.action_name = action_name
-        self.last_update_time = 0
+        self.current = 0
         self.start_time = time.time()
-        self.update_interval = 4
+        self.samples = deque([(time.monotonic(), 0)], maxlen=WINDOW_SIZE)
+        self.ewma_speed = 0.0
+
+    async def update(self, current):
+        # Only records the value; the reporter renders it when it next edits
+        self.current = current
+        self._record(time.monotonic(), current)
+        self.reporter.publish(self.render)
 
-    async def update(self, current, force=False):
-        now = time.time()
-        if not force and (now - self.last_update_time) < self.update_interval:
+    def _record(self, now, current):
+        last_time, last_value = self.samples[-1]
+        if now - last_time < SAMPLE_SPACING:
             return
+        rate = max(0, current - last_value) / (now - last_time)
+        if len(self.samples) == 1:
+            self.ewma_speed = rate
+        else:
+            self.ewma_speed = EWMA_ALPHA * rate + (1 - EWMA_ALPHA) * self.ewma_speed
+        self.samples.append((now, current))
+
+    def snapshot(self):
+        now = time.monotonic()
+        # Count the latest value even if it came in between samples
+        first_time, first_value = self.samples[0]
+        window = now - first_time
+        speed = max(0, self.current - first_value) / window if window > 0 else 0
+        elapsed = time.time() - self.start_time
+        average_speed = self.current / elapsed if elapsed > 0 else 0
+
+        eta = None
+        rate = self.ewma_speed or speed
+        if self.total_size > 0 and rate > 0:
+            eta = max(0, self.total_size - self.current) / rate
+
+        return ProgressSnapshot(
+            self.action_name, self.current, self.total_size, elapsed,
+            speed, self.ewma_speed, average_speed, eta,
+        )
+
+    def render(self):
+        snap = self.snapshot()
+        percentage = (snap.current / snap.total) * 100 if snap.total > 0 else 0
+
+        speed_str = f"{human_readable_size(snap.speed)}/s (avg {human_readable_size(snap.average_speed)}/s)"
+        current_str = human_readable_size(snap.current)
+        total_str = human_readable_size(snap.total)
 
-        self.last_update_time = now
-        percentage = (current / self.total_size) * 100 if self.total_size > 0 else 0
-        speed = current / (now - self.start_time) if (now - self.start_time) > 0 else 0
-        elapsed_time = now - self.start_time
-        
-        def human_readable_size(size):
-            for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-                if size < 1024:
-                    return f"{size:.2f} {unit}"
-                size /= 1024
-            return f"{size:.2f} PB"
-
-        speed_str = f"{human_readable_size(speed)}/s"
-        current_str = human_readable_size(current)
-        total_str = human_readable_size(self.total_size)
-        
         bar_length = 20
         filled_length = int(bar_length * percentage // 100)
         bar = '█' * filled_length + '░' * (bar_length - filled_length)
-        
+
+        # Cached snapshot from the background sampler; no syscalls here
         stats = get_system_stats()
-        
-        text = (
+
+        return (
             f"**{self.action_name}**\n"
             f"[{bar}] {percentage:.1f}%\n"
             f"**Progress:** {current_str} / {total_str}\n"
             f"**Speed:** {speed_str}\n"
-            f"**Elapsed:** {elapsed_time:.1f}s\n\n"
-            f"**System Stats:**\n`{stats}`"
+            f"**ETA:** {format_duration(snap.eta)}\n"
+            f"**Elapsed:** {snap.elapsed:.1f}s\n\n"
+            f"**System Stats:**\n" + "\n".join(f"`{line}`" for line in stats.splitlines())
         )
-        
-        try:
-            await self.message.edit_text(text)
-        except Exception:
-            pass
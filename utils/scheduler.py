@@ -0,0 +1,131 @@
+import time
+import heapq
+import asyncio
+import itertools
+from collections import deque
+from config import MAX_CONCURRENT_JOBS, DOWNLOAD_SLOTS, TRANSCODE_WORKERS, UPLOAD_SLOTS
+from utils.metrics import Gauge
+
+
+class Job:
+    def __init__(self, job_id, name, factory, priority, owner):
+        self.id = job_id
+        self.name = name
+        self.factory = factory
+        self.priority = priority
+        self.owner = owner
+        self.state = "queued"
+        self.created = time.time()
+        self.started = None
+        self.cancelled = False
+        self.task = None
+        # Stage name -> Progress, for live speed/ETA while the job runs
+        self.progress = {}
+        # The job's JobTrace while it runs, and the archived file afterwards
+        self.trace = None
+        self.trace_path = None
+
+
+class JobScheduler:
+    """Runs backup jobs from a priority queue, at most `max_jobs` at a time.
+    Stages that compete across jobs (downloads, video encodes, uploads) take
+    a slot from the shared budgets in `slots` while they work."""
+
+    def __init__(self, max_jobs=MAX_CONCURRENT_JOBS):
+        self.max_jobs = max_jobs
+        self.jobs = {}
+        self.slots = {
+            "download": asyncio.Semaphore(DOWNLOAD_SLOTS),
+            "transcode": asyncio.Semaphore(TRANSCODE_WORKERS),
+            "upload": asyncio.Semaphore(UPLOAD_SLOTS),
+        }
+        self._queue = []
+        # Recently finished jobs, so /trace still finds them by id
+        self.finished = deque(maxlen=20)
+        self._ids = itertools.count(1)
+        self._order = itertools.count()
+
+    def slot(self, stage):
+        return self.slots[stage]
+
+    def submit(self, name, factory, priority=0, owner=None):
+        """Queue `factory(job)`, a coroutine function that runs the job.
+        Higher priorities start first, equal ones in submission order."""
+        job = Job(next(self._ids), name, factory, priority, owner)
+        self.jobs[job.id] = job
+        heapq.heappush(self._queue, (-priority, next(self._order), job))
+        self._dispatch()
+        return job
+
+    def _dispatch(self):
+        while self._queue and len(self.running()) < self.max_jobs:
+            _, _, job = heapq.heappop(self._queue)
+            if job.state != "queued":
+                continue
+            job.state = "running"
+            job.started = time.time()
+            job.task = asyncio.create_task(job.factory(job))
+            job.task.add_done_callback(lambda _, job=job: self._finished(job))
+
+    def _finished(self, job):
+        job.state = "cancelled" if job.cancelled else "done"
+        self.jobs.pop(job.id, None)
+        self.finished.append(job)
+        self._dispatch()
+
+    def find(self, job_id):
+        """A queued, running or recently finished job."""
+        if job_id in self.jobs:
+            return self.jobs[job_id]
+        return next((job for job in self.finished if job.id == job_id), None)
+
+    def running(self):
+        return [job for job in self.jobs.values() if job.state == "running"]
+
+    def queued(self):
+        return [job for _, _, job in sorted(self._queue) if job.state == "queued"]
+
+    def position(self, job):
+        """1-based place in the queue, or 0 once the job has started."""
+        queued = self.queued()
+        return queued.index(job) + 1 if job in queued else 0
+
+    def set_priority(self, job_id, priority):
+        job = self.jobs.get(job_id)
+        if not job or job.state != "queued":
+            return False
+        job.priority = priority
+        self._queue = [(-j.priority, order, j) for _, order, j in self._queue]
+        heapq.heapify(self._queue)
+        return True
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if not job:
+            return False
+        job.cancelled = True
+        if job.state == "queued":
+            job.state = "cancelled"
+            self.jobs.pop(job.id, None)
+        elif job.task:
+            job.task.cancel()
+        return True
+
+    async def shutdown(self):
+        """Stop everything without marking jobs cancelled, so running jobs keep
+        their journal and resume on the next start."""
+        for _, _, job in self._queue:
+            job.state = "cancelled"
+        self._queue = []
+        tasks = [job.task for job in self.running() if job.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+job_scheduler = JobScheduler()
+
+Gauge(
+    "jobs", "Backup jobs by state", ["state"],
+    function=lambda: {("running",): len(job_scheduler.running()), ("queued",): len(job_scheduler.queued())},
+)
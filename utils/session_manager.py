@@ -12,6 +12,7 @@ class SessionManager:
             'url': url,
             'media_types': {'photos', 'videos', 'gifs', 'documents', 'other'},
             'dump_channel': DUMP_CHAT_ID,
+            'source': 'zip',
             'timestamp': time.time(),
             'awaiting_channel_input': False
         }
@@ -57,6 +58,14 @@ class SessionManager:
             session['dump_channel'] = channel_id
             self.update_timestamp(user_id)
     
+    def toggle_source(self, user_id: int) -> Optional[str]:
+        session = self.get_session(user_id)
+        if not session:
+            return None
+        session['source'] = 'api' if session['source'] == 'zip' else 'zip'
+        self.update_timestamp(user_id)
+        return session['source']
+    
     def get_dump_channel(self, user_id: int) -> Optional[int]:
         session = self.get_session(user_id)
         return session['dump_channel'] if session else None
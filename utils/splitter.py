@@ -0,0 +1,112 @@
+import os
+import json
+import shlex
+import asyncio
+from utils.video_processor import MAX_TELEGRAM_SIZE, probe_video, run_ffmpeg
+
+PART_SIZE = int(MAX_TELEGRAM_SIZE)
+# Keyframe cuts can't hit a size exactly, so aim video parts below the limit
+VIDEO_PART_TARGET = 0.85
+
+def _copy_range(src_fd, dst_fd, offset, length):
+    # copy_file_range/sendfile move the bytes inside the kernel (and can
+    # reflink on CoW filesystems), so slicing never goes through user space
+    copied = 0
+    while copied < length:
+        try:
+            count = os.copy_file_range(src_fd, dst_fd, length - copied, offset + copied)
+        except (AttributeError, OSError):
+            count = os.sendfile(dst_fd, src_fd, offset + copied, length - copied)
+        if count == 0:
+            break
+        copied += count
+    return copied
+
+def _split_file_sync(input_path, part_size):
+    total = os.path.getsize(input_path)
+    parts = []
+    src_fd = os.open(input_path, os.O_RDONLY)
+    try:
+        offset = 0
+        index = 1
+        while offset < total:
+            length = min(part_size, total - offset)
+            part_path = f"{input_path}.{index:03d}"
+            dst_fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                if _copy_range(src_fd, dst_fd, offset, length) != length:
+                    raise Exception(f"Short copy while splitting {input_path}")
+            finally:
+                os.close(dst_fd)
+            parts.append(part_path)
+            offset += length
+            index += 1
+    finally:
+        os.close(src_fd)
+    return parts
+
+async def split_file(input_path: str, part_size: int = PART_SIZE) -> list:
+    """Cut a file into `part_size` byte slices named `<file>.001`, `.002`, ...
+    that rejoin with a plain `cat`."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _split_file_sync, input_path, part_size)
+
+async def split_video(input_path: str, max_size: int = PART_SIZE) -> list:
+    """Split a video losslessly at keyframes into independently playable
+    parts under `max_size`. Returns [] if that can't be done."""
+    probe = await probe_video(input_path)
+    if not probe:
+        return []
+
+    file_size = os.path.getsize(input_path)
+    segment_time = probe['duration'] * (max_size * VIDEO_PART_TARGET) / file_size
+    base, ext = os.path.splitext(input_path)
+    pattern = f"{base}_part%03d{ext}"
+
+    cmd = [
+        "ffmpeg", "-i", input_path,
+        "-map", "0:v",
+        "-map", "0:a?",
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_time", f"{segment_time:.3f}",
+        "-reset_timestamps", "1",
+        "-y",
+        pattern
+    ]
+    returncode, stderr = await run_ffmpeg(cmd, "split")
+
+    directory = os.path.dirname(input_path) or "."
+    prefix = os.path.basename(f"{base}_part")
+    parts = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith(prefix) and name.endswith(ext)
+    )
+
+    if returncode != 0 or not parts or any(os.path.getsize(part) > max_size for part in parts):
+        # Sparse keyframes can leave a part over the limit; let the caller
+        # fall back to byte slicing rather than upload something that fails
+        if returncode != 0:
+            print(f"FFmpeg split failed: {stderr[-500:]}")
+        for part in parts:
+            os.remove(part)
+        return []
+    return parts
+
+def write_manifest(input_path: str, parts: list, mode: str) -> str:
+    manifest_path = f"{input_path}.manifest.json"
+    name = os.path.basename(input_path)
+    manifest = {
+        'name': name,
+        'size': os.path.getsize(input_path),
+        'mode': mode,
+        'parts': [
+            {'name': os.path.basename(part), 'size': os.path.getsize(part)}
+            for part in parts
+        ],
+    }
+    if mode == 'bytes':
+        manifest['join'] = f"cat {' '.join(shlex.quote(os.path.basename(p)) for p in parts)} > {shlex.quote(name)}"
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest_path
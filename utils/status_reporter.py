@@ -0,0 +1,73 @@
+import asyncio
+from pyrogram.errors import FloodWait
+from config import STATUS_INTERVAL
+from utils.metrics import FLOODWAIT_SECONDS
+
+
+class StatusReporter:
+    """Owns a job's status message. Stages `publish` their latest state (text,
+    or a callable rendered at edit time) without awaiting Telegram; a single
+    task edits the message at most once per `interval`, so states published
+    in between are simply replaced."""
+
+    def __init__(self, message, interval=STATUS_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self._state = None
+        self._last_text = None
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    def publish(self, state):
+        self._state = state
+        self._wake.set()
+
+    def _render(self):
+        state = self._state
+        return state() if callable(state) else state
+
+    async def _edit(self, text):
+        if not text or text == self._last_text:
+            return
+        await self.message.edit_text(text)
+        self._last_text = text
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            try:
+                await self._edit(self._render())
+            except FloodWait as e:
+                FLOODWAIT_SECONDS.inc(e.value, scope="status")
+                await asyncio.sleep(e.value)
+                self._wake.set()
+            except Exception as e:
+                print(f"⚠️ Status update failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def finish(self, text=None):
+        """Stop the reporter and show `text` (or the last published state)
+        right away, so no stale update can land after it."""
+        await self.stop()
+        if text is not None:
+            self._state = text
+        try:
+            try:
+                await self._edit(self._render())
+            except FloodWait as e:
+                await asyncio.sleep(e.value)
+                await self._edit(self._render())
+        except Exception as e:
+            print(f"⚠️ Status update failed: {e}")
@@ -1,11 +1,106 @@
 import psutil
 import os
+import time
+import asyncio
+from collections import deque
+from config import STATS_INTERVAL, STATS_HISTORY
+from utils.job_journal import JOBS_DIR
+
+
+def _human_rate(rate):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if rate < 1024:
+            return f"{rate:.1f} {unit}/s"
+        rate /= 1024
+    return f"{rate:.1f} TB/s"
+
+
+class StatsSampler:
+    """Samples CPU, RAM, disk and network counters every `interval` seconds
+    in a worker thread and keeps the last `history` snapshots. Readers only
+    look at `latest`, so rendering never touches psutil on the event loop."""
+
+    def __init__(self, interval=STATS_INTERVAL, history=STATS_HISTORY, path=JOBS_DIR):
+        self.interval = interval
+        self.path = path
+        self.samples = deque(maxlen=history)
+        self._counters = None
+        self._task = None
+
+    @property
+    def latest(self):
+        return self.samples[-1] if self.samples else None
+
+    def _sample(self):
+        now = time.monotonic()
+        # With a fixed cadence this is the CPU use since the previous sample
+        cpu = psutil.cpu_percent(interval=None)
+        ram = psutil.virtual_memory()
+        disk_io = psutil.disk_io_counters()
+        net_io = psutil.net_io_counters()
+        free = psutil.disk_usage(self.path if os.path.isdir(self.path) else ".").free
+
+        counters = (
+            now,
+            disk_io.read_bytes if disk_io else 0,
+            disk_io.write_bytes if disk_io else 0,
+            net_io.bytes_recv if net_io else 0,
+            net_io.bytes_sent if net_io else 0,
+        )
+        rates = [0.0] * 4
+        if self._counters is not None and now > self._counters[0]:
+            elapsed = now - self._counters[0]
+            rates = [max(0, new - old) / elapsed for new, old in zip(counters[1:], self._counters[1:])]
+        self._counters = counters
+
+        return {
+            'time': time.time(),
+            'cpu_percent': cpu,
+            'ram_used': ram.used,
+            'ram_total': ram.total,
+            'ram_percent': ram.percent,
+            'disk_read_rate': rates[0],
+            'disk_write_rate': rates[1],
+            'net_recv_rate': rates[2],
+            'net_sent_rate': rates[3],
+            'disk_free': free,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                self.samples.append(await loop.run_in_executor(None, self._sample))
+            except Exception as e:
+                print(f"⚠️ Stats sampling failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+stats_sampler = StatsSampler()
+
 
 def get_system_stats():
-    cpu_percent = psutil.cpu_percent(interval=None)
-    ram = psutil.virtual_memory()
-    ram_percent = ram.percent
-    ram_used = ram.used / (1024 ** 3)
-    ram_total = ram.total / (1024 ** 3)
-    
-    return f"CPU: {cpu_percent}% | RAM: {ram_used:.1f}/{ram_total:.1f}GB ({ram_percent}%)"
+    sample = stats_sampler.latest
+    if sample is None:
+        return "Collecting system stats..."
+
+    ram_used = sample['ram_used'] / (1024 ** 3)
+    ram_total = sample['ram_total'] / (1024 ** 3)
+    free = sample['disk_free'] / (1024 ** 3)
+
+    return (
+        f"CPU: {sample['cpu_percent']}% | RAM: {ram_used:.1f}/{ram_total:.1f}GB ({sample['ram_percent']}%)\n"
+        f"Disk: R {_human_rate(sample['disk_read_rate'])} W {_human_rate(sample['disk_write_rate'])} | Free: {free:.1f}GB\n"
+        f"Net: ↓ {_human_rate(sample['net_recv_rate'])} ↑ {_human_rate(sample['net_sent_rate'])}"
+    )
@@ -0,0 +1,137 @@
+import os
+import glob
+import json
+import time
+import shutil
+import contextvars
+
+TRACES_DIR = "traces"
+# Traces of running or interrupted jobs. They live outside the job's work
+# directory, which a reset wipes, and move to TRACES_DIR when the job ends.
+LIVE_TRACES_DIR = os.path.join(TRACES_DIR, "live")
+# Finished traces kept in TRACES_DIR; the oldest are deleted beyond this
+TRACE_HISTORY = 50
+
+# The trace of the job the current task works for. Tasks started by a job
+# (pipeline workers, download workers) inherit it, so shared helpers can add
+# spans and events without being handed the trace.
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Span:
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.bytes = 0
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is None:
+            return False
+        status = "ok"
+        if exc_type is not None:
+            status = "cancelled" if exc_type.__name__ == "CancelledError" else "error"
+            if status == "error":
+                self.attrs["error"] = str(exc)[:200]
+        end = time.time()
+        self.trace.write({
+            "name": self.name,
+            "start": self.start,
+            "end": end,
+            "duration": end - self.start,
+            "bytes": self.bytes,
+            "status": status,
+            "attrs": self.attrs,
+        })
+        return False
+
+
+class JobTrace:
+    """Appends one JSON object per finished span to `path`. A resumed job
+    appends to the same file, so the trace covers every attempt."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def span(self, name, **attrs):
+        return Span(self, name, attrs)
+
+    def event(self, name, duration=0, **attrs):
+        """A point in time, or a wait imposed from outside (e.g. FloodWait)."""
+        now = time.time()
+        self.write({
+            "name": name, "start": now, "end": now + duration, "duration": duration,
+            "bytes": 0, "status": "ok", "attrs": attrs,
+        })
+
+    def write(self, record):
+        if self._file.closed:
+            return
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def archive(self, key):
+        """Move the finished trace to TRACES_DIR, keeping the newest TRACE_HISTORY."""
+        self.close()
+        if not os.path.exists(self.path):
+            return None
+        os.makedirs(TRACES_DIR, exist_ok=True)
+        dest = os.path.join(TRACES_DIR, f"{key}.jsonl")
+        shutil.move(self.path, dest)
+        traces = sorted(glob.glob(os.path.join(TRACES_DIR, "*.jsonl")), key=os.path.getmtime)
+        for old in traces[:-TRACE_HISTORY]:
+            os.remove(old)
+        return dest
+
+
+def live_trace_path(key):
+    return os.path.join(LIVE_TRACES_DIR, f"{key}.jsonl")
+
+
+def span(name, **attrs):
+    """A span on the current job's trace; does nothing outside a job."""
+    return Span(current_trace.get(), name, attrs)
+
+
+def event(name, duration=0, **attrs):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.event(name, duration, **attrs)
+
+
+def load_trace(path):
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # The last line may be cut short by a crash
+                continue
+    return records
+
+
+def summarize(records):
+    """Per-span-name totals: count, summed and longest duration, bytes."""
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record["name"], {"count": 0, "duration": 0.0, "max": 0.0, "bytes": 0, "errors": 0})
+        total["count"] += 1
+        total["duration"] += record["duration"]
+        total["max"] = max(total["max"], record["duration"])
+        total["bytes"] += record["bytes"]
+        if record["status"] == "error":
+            total["errors"] += 1
+    return totals
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from pyrogram.errors import FloodWait
+from config import UPLOAD_RATE_PER_MINUTE, UPLOAD_MAX_INFLIGHT_MB
+from utils.metrics import Gauge, UPLOAD_SECONDS, UPLOAD_BYTES, FLOODWAIT_SECONDS
+from utils.tracer import event
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, cost=1):
+        cost = min(cost, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                await asyncio.sleep((cost - self.tokens) / self.rate)
+
+
+class UploadLimiter:
+    """Shared by every upload worker: one token bucket per destination chat,
+    a single FloodWait gate that pauses all workers at once, and a cap on
+    the bytes being uploaded concurrently."""
+
+    def __init__(self, per_minute=UPLOAD_RATE_PER_MINUTE, max_inflight_bytes=UPLOAD_MAX_INFLIGHT_MB * 1024 * 1024):
+        self.per_minute = per_minute
+        self.max_inflight_bytes = max_inflight_bytes
+        self.inflight_bytes = 0
+        self.flood_until = 0
+        self.buckets = {}
+        self._inflight = asyncio.Condition()
+
+    def _bucket(self, chat_id):
+        if chat_id not in self.buckets:
+            self.buckets[chat_id] = TokenBucket(self.per_minute / 60, self.per_minute)
+        return self.buckets[chat_id]
+
+    def flood_wait(self, seconds):
+        self.flood_until = max(self.flood_until, time.monotonic() + seconds)
+
+    async def _wait_flood(self):
+        while True:
+            delay = self.flood_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def _reserve(self, size):
+        async with self._inflight:
+            # A single file larger than the cap may still go alone
+            await self._inflight.wait_for(
+                lambda: self.inflight_bytes == 0 or self.inflight_bytes + size <= self.max_inflight_bytes
+            )
+            self.inflight_bytes += size
+
+    async def _release(self, size):
+        async with self._inflight:
+            self.inflight_bytes -= size
+            self._inflight.notify_all()
+
+    async def send(self, chat_id, size, send_func, label, cost=1, max_retries=3):
+        """Call `send_func()` under the limits, retrying on errors. Returns its
+        result, or None once `max_retries` attempts have failed."""
+        retry_count = 0
+
+        while retry_count < max_retries:
+            await self._wait_flood()
+            await self._bucket(chat_id).acquire(cost)
+            await self._reserve(size)
+            started = time.perf_counter()
+            try:
+                result = await send_func()
+                UPLOAD_SECONDS.observe(time.perf_counter() - started, outcome="ok")
+                UPLOAD_BYTES.inc(size)
+                return result
+            except FloodWait as e:
+                UPLOAD_SECONDS.observe(time.perf_counter() - started, outcome="floodwait")
+                FLOODWAIT_SECONDS.inc(e.value, scope="chat")
+                event("floodwait", e.value, scope="chat", file=label)
+                print(f"⏳ FloodWait ({label}): pausing all uploads for {e.value}s...")
+                self.flood_wait(e.value)
+                retry_count += 1
+            except Exception as e:
+                UPLOAD_SECONDS.observe(time.perf_counter() - started, outcome="error")
+                print(f"❌ Upload error for {label}: {e}")
+                retry_count += 1
+                if retry_count < max_retries:
+                    await asyncio.sleep(2)
+            finally:
+                await self._release(size)
+
+        print(f"⚠️ Skipping {label} after {max_retries} retries")
+        return None
+
+
+upload_limiter = UploadLimiter()
+
+Gauge(
+    "upload_inflight_bytes", "Bytes currently being uploaded",
+    function=lambda: {(): upload_limiter.inflight_bytes},
+)
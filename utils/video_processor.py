@@ -0,0 +1,221 @@
+import os
+import json
+import shutil
+import asyncio
+from config import TRANSCODE_WORKERS, TRANSCODE_SEGMENT_SECONDS
+from utils.scheduler import job_scheduler
+from utils.metrics import FFMPEG_SECONDS
+
+MAX_TELEGRAM_SIZE = 1.95 * 1024 * 1024 * 1024
+VIDEO_CRF_H265 = 24
+AUDIO_BITRATE = 128_000
+# Share of MAX_TELEGRAM_SIZE the planner spends, leaving room for the
+# container, the VBV buffer and audio bitrate overshoot
+SIZE_MARGIN = 0.94
+
+async def run_ffmpeg(cmd, operation="ffmpeg"):
+    with FFMPEG_SECONDS.time(operation=operation):
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await proc.communicate()
+    return proc.returncode, stderr.decode(errors='replace') if stderr else ''
+
+async def probe_video(input_path: str):
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration:stream=codec_type",
+        "-of", "json",
+        input_path
+    ]
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, _ = await proc.communicate()
+    if proc.returncode != 0:
+        return None
+    try:
+        info = json.loads(stdout)
+        return {
+            'duration': float(info['format']['duration']),
+            'has_audio': any(stream.get('codec_type') == 'audio' for stream in info.get('streams', [])),
+        }
+    except (KeyError, ValueError, TypeError):
+        return None
+
+def plan_video_bitrate(duration: float, has_audio: bool):
+    """Highest video bitrate (bits/s) whose output still fits Telegram's
+    limit, or None if even the audio alone would not fit."""
+    if duration <= 0:
+        return None
+    audio_bits = AUDIO_BITRATE * duration if has_audio else 0
+    video_bits = MAX_TELEGRAM_SIZE * SIZE_MARGIN * 8 - audio_bits
+    if video_bits <= 0:
+        return None
+    return int(video_bits / duration)
+
+def _rate_args(max_bitrate):
+    # CRF keeps quality-driven rate control; the VBV cap (1 s buffer) bounds
+    # the total so a single pass always lands under the planned size
+    if not max_bitrate:
+        return []
+    kbps = str(max(1, max_bitrate // 1000)) + "k"
+    return ["-maxrate", kbps, "-bufsize", kbps]
+
+def _x265_params():
+    # Each concurrent encode gets its own share of the cores instead of every
+    # x265 instance spinning up a thread pool the size of the machine
+    threads = max(1, (os.cpu_count() or 1) // TRANSCODE_WORKERS)
+    return f"pools={threads}:frame-threads={min(threads, 4)}"
+
+async def _split_at_keyframes(input_path: str, work_dir: str) -> list:
+    # Stream copy cuts only on keyframes, so every segment decodes on its own
+    cmd = [
+        "ffmpeg", "-i", input_path,
+        "-map", "0:v:0",
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_time", str(TRANSCODE_SEGMENT_SECONDS),
+        "-reset_timestamps", "1",
+        "-y",
+        os.path.join(work_dir, "src_%05d.mkv")
+    ]
+    returncode, stderr = await run_ffmpeg(cmd, "segment")
+    if returncode != 0:
+        print(f"FFmpeg segmenting failed: {stderr[-500:]}")
+        return []
+    return sorted(
+        os.path.join(work_dir, name) for name in os.listdir(work_dir)
+        if name.startswith("src_")
+    )
+
+async def _encode_segment(segment_path: str, output_path: str, crf: int, max_bitrate=None) -> bool:
+    cmd = [
+        "ffmpeg", "-i", segment_path,
+        "-c:v", "libx265",
+        "-crf", str(crf),
+        *_rate_args(max_bitrate),
+        "-preset", "medium",
+        "-x265-params", _x265_params(),
+        "-pix_fmt", "yuv420p",
+        "-an",
+        "-y",
+        output_path
+    ]
+    # The transcode budget is shared by every running job
+    async with job_scheduler.slot("transcode"):
+        returncode, stderr = await run_ffmpeg(cmd, "encode_segment")
+    if returncode != 0:
+        print(f"FFmpeg segment encode failed: {stderr[-500:]}")
+        return False
+    return True
+
+async def _transcode_segmented(input_path: str, output_path: str, crf: int, max_bitrate=None) -> bool:
+    work_dir = f"{output_path}_segments"
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        segments = await _split_at_keyframes(input_path, work_dir)
+        if len(segments) < 2:
+            return await _transcode_single(input_path, output_path, crf, max_bitrate)
+
+        encoded = [
+            os.path.join(work_dir, os.path.basename(segment).replace("src_", "enc_"))
+            for segment in segments
+        ]
+        results = await asyncio.gather(*(
+            _encode_segment(segment, target, crf, max_bitrate) for segment, target in zip(segments, encoded)
+        ))
+        if not all(results):
+            return False
+
+        list_path = os.path.join(work_dir, "concat.txt")
+        with open(list_path, 'w') as f:
+            for path in encoded:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+
+        # Concat the encoded video losslessly and encode the audio once from
+        # the source, which avoids AAC priming gaps at every segment boundary
+        cmd = [
+            "ffmpeg",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-i", input_path,
+            "-map", "0:v:0",
+            "-map", "1:a:0?",
+            "-c:v", "copy",
+            "-tag:v", "hvc1",
+            "-c:a", "aac",
+            "-b:a", "128k",
+            "-movflags", "+faststart",
+            "-y",
+            output_path
+        ]
+        returncode, stderr = await run_ffmpeg(cmd, "concat")
+        if returncode != 0:
+            print(f"FFmpeg concat failed: {stderr[-500:]}")
+            return False
+        return os.path.exists(output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+async def _transcode_single(input_path: str, output_path: str, crf: int, max_bitrate=None) -> bool:
+    cmd = [
+        "ffmpeg", "-i", input_path,
+        "-c:v", "libx265",
+        "-crf", str(crf),
+        *_rate_args(max_bitrate),
+        "-preset", "medium",
+        "-pix_fmt", "yuv420p",
+        "-tag:v", "hvc1",
+        "-c:a", "aac",
+        "-b:a", "128k",
+        "-movflags", "+faststart",
+        "-y",
+        output_path
+    ]
+    async with job_scheduler.slot("transcode"):
+        returncode, stderr = await run_ffmpeg(cmd, "encode")
+    if returncode != 0:
+        print(f"FFmpeg failed: {stderr or 'Unknown error'}")
+        return False
+    return os.path.exists(output_path)
+
+async def compress_video_h265(input_path: str, output_path: str, status=None) -> bool:
+    try:
+        if status:
+            status.publish(f"🎬 Compressing video with H.265/HEVC (Near-Lossless Quality)...")
+
+        max_bitrate = None
+        probe = await probe_video(input_path)
+        if probe:
+            max_bitrate = plan_video_bitrate(probe['duration'], probe['has_audio'])
+            if max_bitrate is None:
+                print(f"Video too long to fit {MAX_TELEGRAM_SIZE / (1024**3):.2f} GB at any bitrate: {input_path}")
+                return False
+        else:
+            print(f"FFprobe failed, encoding without a size cap: {input_path}")
+
+        if not await _transcode_segmented(input_path, output_path, VIDEO_CRF_H265, max_bitrate):
+            return False
+
+        output_size = os.path.getsize(output_path)
+        original_size = os.path.getsize(input_path)
+
+        if output_size < original_size and output_size < MAX_TELEGRAM_SIZE:
+            if status:
+                reduction = (1 - output_size / original_size) * 100
+                status.publish(
+                    f"✅ Video compressed successfully!\n"
+                    f"📉 Size reduced by {reduction:.1f}%\n"
+                    f"Original: {original_size / (1024*1024*1024):.2f} GB\n"
+                    f"Compressed: {output_size / (1024*1024*1024):.2f} GB"
+                )
+            return True
+        return False
+    except Exception as e:
+        print(f"Video compression error: {e}")
+        return False
@@ -1,28 +1,299 @@
 import zipfile
 import os
+import io
+import struct
+import time
+import queue
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from config import EXTRACT_WORKERS
+from utils.metrics import EXTRACT_BYTES, EXTRACT_FILES
 
 executor = ThreadPoolExecutor()
+process_executor = None
 
-def _extract_zip_sync(zip_path, extract_to, progress_callback_sync=None):
+# Seconds between progress callbacks handed back to the event loop
+PROGRESS_CALLBACK_INTERVAL = 0.5
+# Extracted files the parallel workers may queue for the consumer. On top of
+# these, each worker can hold one written file it is waiting to queue and the
+# consumer one it is handing on, which bounds how far extraction runs ahead.
+EXTRACT_QUEUE_SIZE = EXTRACT_WORKERS
+EXTRACT_LOOKAHEAD = EXTRACT_QUEUE_SIZE + EXTRACT_WORKERS + 1
+
+def list_zip_members(zip_path):
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        return [info for info in zip_ref.infolist() if not info.is_dir()]
+
+def central_directory_span(tail):
+    """How many bytes from the end of the archive hold the central directory
+    and end records, given a tail that contains the end record."""
+    pos = tail.rfind(b'PK\x05\x06')
+    if pos < 0 or len(tail) < pos + 20:
+        return None
+    cd_size = struct.unpack('<I', tail[pos + 12:pos + 16])[0]
+    if pos >= 20 and tail[pos - 20:pos - 16] == b'PK\x06\x07':
+        # A zip64 locator means the real sizes live in the zip64 end record
+        pos = tail.rfind(b'PK\x06\x06', 0, pos - 20)
+        if pos < 0:
+            return None
+        cd_size = struct.unpack('<Q', tail[pos + 40:pos + 48])[0]
+    return cd_size + len(tail) - pos
+
+def list_members_from_tail(tail):
+    # zipfile treats the missing front of the archive as prepended data, so
+    # the central directory alone is enough to list every member
+    with zipfile.ZipFile(io.BytesIO(tail), 'r') as zip_ref:
+        return [info for info in zip_ref.infolist() if not info.is_dir()]
+
+def _partition_members(infos, workers):
+    # Longest-processing-time-first: hand the next largest member to the
+    # worker with the least compressed bytes so far
+    shares = [[] for _ in range(workers)]
+    loads = [0] * workers
+    for info in sorted(infos, key=lambda i: i.compress_size, reverse=True):
+        index = loads.index(min(loads))
+        shares[index].append(info.filename)
+        loads[index] += info.compress_size
+    return [share for share in shares if share]
+
+def _extract_members_worker(zip_path, names, extract_to, events, stop):
+    # Runs in a pool process with its own ZipFile handle on the archive
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for name in names:
+            if stop.is_set():
+                return
+            info = zip_ref.getinfo(name)
+            extracted_path = zip_ref.extract(info, extract_to)
+            events.put((extracted_path, info.file_size))
+
+def _get_process_executor():
+    global process_executor
+    if process_executor is None:
+        process_executor = ProcessPoolExecutor(
+            max_workers=EXTRACT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return process_executor
+
+def _extract_zip_parallel(zip_path, infos, extract_to, total_size, extracted_size,
+                          progress_callback_sync=None, file_callback_sync=None):
+    shares = _partition_members(infos, EXTRACT_WORKERS)
+
+    with multiprocessing.get_context("spawn").Manager() as manager:
+        # Bounded so workers block instead of running far ahead of a slow consumer
+        events = manager.Queue(maxsize=EXTRACT_QUEUE_SIZE)
+        stop = manager.Event()
+        futures = [
+            _get_process_executor().submit(_extract_members_worker, zip_path, share, extract_to, events, stop)
+            for share in shares
+        ]
+
+        try:
+            while True:
+                for future in futures:
+                    if future.done() and future.exception():
+                        raise future.exception()
+                try:
+                    extracted_path, file_size = events.get(timeout=0.5)
+                except queue.Empty:
+                    if all(future.done() for future in futures) and events.empty():
+                        break
+                    continue
+
+                extracted_size += file_size
+                if progress_callback_sync:
+                    progress_callback_sync(extracted_size, total_size)
+                if file_callback_sync:
+                    file_callback_sync(extracted_path)
+        finally:
+            stop.set()
+            while not all(future.done() for future in futures):
+                try:
+                    events.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+def _extract_zip_sync(zip_path, extract_to, progress_callback_sync=None, file_callback_sync=None, skip_names=None):
+    # Every member may be skipped (e.g. all known duplicates), so nothing
+    # else would create the directory
+    os.makedirs(extract_to, exist_ok=True)
     with zipfile.ZipFile(zip_path, 'r') as zip_ref:
         total_size = sum((file.file_size for file in zip_ref.infolist()))
         extracted_size = 0
-        
+        pending = []
+
         for file in zip_ref.infolist():
-            zip_ref.extract(file, extract_to)
+            if skip_names and file.filename in skip_names:
+                extracted_size += file.file_size
+            elif file.is_dir():
+                zip_ref.extract(file, extract_to)
+            else:
+                pending.append(file)
+
+        if EXTRACT_WORKERS > 1 and len(pending) > EXTRACT_WORKERS:
+            _extract_zip_parallel(
+                zip_path, pending, extract_to, total_size, extracted_size,
+                progress_callback_sync, file_callback_sync,
+            )
+            return os.listdir(extract_to)
+
+        for file in pending:
+            extracted_path = zip_ref.extract(file, extract_to)
             extracted_size += file.file_size
             if progress_callback_sync:
                 progress_callback_sync(extracted_size, total_size)
-                
+            if file_callback_sync:
+                file_callback_sync(extracted_path)
+
     return os.listdir(extract_to)
 
-async def extract_zip(zip_path, extract_to, progress_callback=None):
+async def extract_zip(zip_path, extract_to, progress_callback=None, file_callback=None, skip_names=None):
     loop = asyncio.get_running_loop()
-    
+
+    last_report = 0
+
     def sync_callback(current, total):
-        if progress_callback:
+        # Archives with many small members would otherwise schedule one
+        # coroutine per member on the event loop
+        nonlocal last_report
+        now = time.monotonic()
+        if progress_callback and (current >= total or now - last_report >= PROGRESS_CALLBACK_INTERVAL):
+            last_report = now
             asyncio.run_coroutine_threadsafe(progress_callback(current, total), loop)
 
-    return await loop.run_in_executor(executor, _extract_zip_sync, zip_path, extract_to, sync_callback)
+    def sync_file_callback(path):
+        EXTRACT_BYTES.inc(os.path.getsize(path), mode="archive")
+        EXTRACT_FILES.inc(mode="archive")
+        # Block the extractor until the consumer accepts the file so a slow
+        # consumer throttles extraction instead of growing an unbounded backlog
+        asyncio.run_coroutine_threadsafe(file_callback(path), loop).result()
+
+    return await loop.run_in_executor(
+        executor,
+        _extract_zip_sync,
+        zip_path,
+        extract_to,
+        sync_callback,
+        sync_file_callback if file_callback else None,
+        skip_names,
+    )
+
+async def extract_member(archive, info, extract_to):
+    # `archive` is a ZipFile the caller keeps open for the whole job; reading
+    # the central directory again for every member is quadratic
+    def _extract():
+        path = archive.extract(info, extract_to)
+        EXTRACT_BYTES.inc(info.file_size, mode="member")
+        EXTRACT_FILES.inc(mode="member")
+        return path
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, _extract)
+
+def member_data_offset(archive, info):
+    # The local header's extra field may differ from the central directory's,
+    # so its length has to be read from the local header itself
+    archive.seek(info.header_offset)
+    header = archive.read(30)
+    if header[:4] != b'PK\x03\x04':
+        raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    return info.header_offset + 30 + name_len + extra_len
+
+class ZipMemberReader(io.RawIOBase):
+    """Seekable read-only view of one ZIP member. Stored members are served
+    as a byte range of the archive; compressed members are inflated on the
+    fly. Pass it anywhere a binary file object with `.name` is accepted.
+
+    `archive` is an open ZipFile shared by every reader of the job; ZipFile
+    serializes reads of its members, and closing a reader leaves it open."""
+
+    def __init__(self, archive, info):
+        super().__init__()
+        self.archive = archive
+        self.info = info
+        self.name = os.path.basename(info.filename)
+        self.size = info.file_size
+        self._pos = 0
+        self._raw = None
+        self._stream = None
+        self._stream_pos = 0
+
+        if info.compress_type == zipfile.ZIP_STORED:
+            # Stored members are plain byte ranges, read through a handle of
+            # their own so concurrent readers never move each other's position
+            self._raw = open(archive.filename, 'rb')
+            self._data_offset = member_data_offset(self._raw, info)
+        else:
+            self._data_offset = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if pos < 0:
+            raise ValueError("Negative seek position")
+        # Only record the position; compressed streams are advanced lazily on read
+        self._pos = pos
+        return pos
+
+    def read(self, size=-1):
+        remaining = self.size - self._pos
+        if remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+
+        if self._data_offset is not None:
+            self._raw.seek(self._data_offset + self._pos)
+            data = self._raw.read(size)
+        else:
+            data = self._read_compressed(size)
+
+        self._pos += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def _read_compressed(self, size):
+        if self._stream is None or self._stream_pos > self._pos:
+            if self._stream is not None:
+                self._stream.close()
+            self._stream = self.archive.open(self.info)
+            self._stream_pos = 0
+
+        while self._stream_pos < self._pos:
+            skipped = self._stream.read(min(self._pos - self._stream_pos, 1024 * 1024))
+            if not skipped:
+                return b''
+            self._stream_pos += len(skipped)
+
+        data = self._stream.read(size)
+        self._stream_pos += len(data)
+        return data
+
+    def close(self):
+        if not self.closed:
+            if self._stream is not None:
+                self._stream.close()
+            if self._raw is not None:
+                self._raw.close()
+        super().close()
@@ -0,0 +1,289 @@
+import os
+import struct
+import zlib
+import aerofs
+from utils.metrics import EXTRACT_BYTES, EXTRACT_FILES
+
+LOCAL_HEADER_SIG = b'PK\x03\x04'
+DATA_DESCRIPTOR_SIG = b'PK\x07\x08'
+CENTRAL_DIR_SIG = b'PK\x01\x02'
+END_OF_CENTRAL_DIR_SIGS = (b'PK\x05\x06', b'PK\x06\x06')
+
+LOCAL_HEADER_SIZE = 30
+ZIP64_EXTRA_ID = 0x0001
+
+
+class ZipStreamError(Exception):
+    pass
+
+
+def safe_member_path(extract_to, name):
+    # Same rules as zipfile.ZipFile._extract_member: drop drive letters,
+    # absolute roots and '..' components so entries cannot escape extract_to
+    name = name.replace('\\', '/')
+    parts = [p for p in name.split('/') if p not in ('', '.', '..')]
+    if not parts:
+        return None
+    return os.path.join(extract_to, *parts)
+
+
+class ZipStreamExtractor:
+    """Extracts a ZIP archive from a forward-only byte stream by walking its
+    local file headers, so entries land on disk while the download is still
+    running. Stops at the central directory, which is never needed."""
+
+    def __init__(self, extract_to, file_callback=None, skip_names=None, wanted=None):
+        self.extract_to = extract_to
+        self.file_callback = file_callback
+        self.skip_names = skip_names or set()
+        self.wanted = wanted
+        self.completed_names = set()
+        # Extracted path -> (CRC32, size), the same identity the central directory gives
+        self.checksums = {}
+        self.extracted_size = 0
+        self.finished = False
+
+        self._buffer = bytearray()
+        self._entry = None
+        self._file = None
+
+    async def feed(self, data):
+        if self.finished:
+            return
+        self._buffer += data
+        while not self.finished:
+            if self._entry is None:
+                if not self._read_header():
+                    return
+                await self._open_entry()
+            elif not await self._read_entry_data():
+                return
+
+    async def close(self):
+        """Close the entry being written when the stream stops early."""
+        await self._close_file()
+
+    async def finish(self):
+        if not self.finished:
+            await self._close_file()
+            raise ZipStreamError("Stream ended in the middle of a ZIP entry")
+
+    def _read_header(self):
+        if len(self._buffer) < 4:
+            return False
+
+        sig = bytes(self._buffer[:4])
+        if sig == CENTRAL_DIR_SIG or sig in END_OF_CENTRAL_DIR_SIGS:
+            self.finished = True
+            self._buffer.clear()
+            return False
+        if sig != LOCAL_HEADER_SIG:
+            head = bytes(self._buffer[:64]).lower()
+            if b'<html' in head or b'<!doctype' in head:
+                raise ZipStreamError("Stream is HTML, not a ZIP file. Dropbox may have returned an error page.")
+            raise ZipStreamError("Unexpected data in ZIP stream (not a local file header)")
+
+        if len(self._buffer) < LOCAL_HEADER_SIZE:
+            return False
+
+        (_, _, flags, method, _, _, crc, comp_size, file_size,
+         name_len, extra_len) = struct.unpack('<4sHHHHHIIIHH', self._buffer[:LOCAL_HEADER_SIZE])
+        header_end = LOCAL_HEADER_SIZE + name_len + extra_len
+        if len(self._buffer) < header_end:
+            return False
+
+        raw_name = bytes(self._buffer[LOCAL_HEADER_SIZE:LOCAL_HEADER_SIZE + name_len])
+        extra = bytes(self._buffer[LOCAL_HEADER_SIZE + name_len:header_end])
+        del self._buffer[:header_end]
+
+        if flags & 0x1:
+            raise ZipStreamError("Encrypted ZIP entries are not supported in streaming mode")
+        if method not in (0, 8):
+            raise ZipStreamError(f"Unsupported compression method {method} in streaming mode")
+
+        zip64 = False
+        if comp_size == 0xFFFFFFFF or file_size == 0xFFFFFFFF:
+            zip64 = True
+            file_size, comp_size = self._parse_zip64_extra(extra, file_size, comp_size)
+        elif self._has_zip64_extra(extra):
+            zip64 = True
+
+        name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437')
+        has_descriptor = bool(flags & 0x8)
+        if method == 0 and has_descriptor and comp_size == 0 and file_size == 0:
+            comp_size = None
+
+        self._entry = {
+            'name': name,
+            'method': method,
+            'crc': crc,
+            'comp_size': comp_size if not has_descriptor or method == 0 else None,
+            'file_size': file_size,
+            'has_descriptor': has_descriptor,
+            'zip64': zip64,
+            'consumed': 0,
+            'written': 0,
+            'running_crc': 0,
+            'decompressor': zlib.decompressobj(-zlib.MAX_WBITS) if method == 8 else None,
+            'path': None,
+        }
+        return True
+
+    @staticmethod
+    def _iter_extra(extra):
+        pos = 0
+        while pos + 4 <= len(extra):
+            header_id, size = struct.unpack('<HH', extra[pos:pos + 4])
+            yield header_id, extra[pos + 4:pos + 4 + size]
+            pos += 4 + size
+
+    def _has_zip64_extra(self, extra):
+        return any(header_id == ZIP64_EXTRA_ID for header_id, _ in self._iter_extra(extra))
+
+    def _parse_zip64_extra(self, extra, file_size, comp_size):
+        for header_id, data in self._iter_extra(extra):
+            if header_id != ZIP64_EXTRA_ID:
+                continue
+            pos = 0
+            if file_size == 0xFFFFFFFF and len(data) >= pos + 8:
+                file_size = struct.unpack('<Q', data[pos:pos + 8])[0]
+                pos += 8
+            if comp_size == 0xFFFFFFFF and len(data) >= pos + 8:
+                comp_size = struct.unpack('<Q', data[pos:pos + 8])[0]
+        return file_size, comp_size
+
+    async def _open_entry(self):
+        entry = self._entry
+        skipped = entry['name'] in self.skip_names or (self.wanted and not self.wanted(entry['name']))
+        if skipped or entry['name'].endswith('/'):
+            if entry['name'].endswith('/'):
+                path = safe_member_path(self.extract_to, entry['name'])
+                if path:
+                    os.makedirs(path, exist_ok=True)
+            return
+
+        path = safe_member_path(self.extract_to, entry['name'])
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry['path'] = path
+        self._file = await aerofs.open(path, 'wb')
+
+    async def _write(self, data):
+        entry = self._entry
+        entry['running_crc'] = zlib.crc32(data, entry['running_crc'])
+        entry['written'] += len(data)
+        if self._file:
+            await self._file.write(data)
+
+    async def _read_entry_data(self):
+        entry = self._entry
+
+        if entry['method'] == 8:
+            if entry['decompressor'].eof:
+                return await self._finish_entry()
+            if not self._buffer:
+                return False
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            decompressor = entry['decompressor']
+            out = decompressor.decompress(data)
+            if out:
+                await self._write(out)
+            if decompressor.eof:
+                self._buffer[:0] = decompressor.unused_data
+                return await self._finish_entry()
+            return False
+
+        if entry['comp_size'] is not None:
+            remaining = entry['comp_size'] - entry['consumed']
+            if remaining > 0:
+                if not self._buffer:
+                    return False
+                take = bytes(self._buffer[:remaining])
+                del self._buffer[:len(take)]
+                entry['consumed'] += len(take)
+                await self._write(take)
+                if entry['consumed'] < entry['comp_size']:
+                    return False
+            return await self._finish_entry()
+
+        return await self._scan_stored_with_descriptor()
+
+    async def _scan_stored_with_descriptor(self):
+        # Stored entries with a data descriptor carry no size up front, so the
+        # end is found by locating a descriptor whose CRC and size match
+        entry = self._entry
+        size_len = 8 if entry['zip64'] else 4
+        descriptor_len = 4 + 4 + size_len * 2
+        search_from = 0
+
+        while True:
+            idx = self._buffer.find(DATA_DESCRIPTOR_SIG, search_from)
+            if idx < 0 or len(self._buffer) < idx + descriptor_len:
+                break
+            crc, comp_size = struct.unpack(
+                '<I' + ('Q' if size_len == 8 else 'I'),
+                self._buffer[idx + 4:idx + 8 + size_len]
+            )
+            candidate = bytes(self._buffer[:idx])
+            if comp_size == entry['written'] + idx and crc == zlib.crc32(candidate, entry['running_crc']):
+                await self._write(candidate)
+                del self._buffer[:idx]
+                entry['comp_size'] = entry['written']
+                entry['consumed'] = entry['written']
+                return await self._finish_entry()
+            search_from = idx + 1
+
+        # Everything except a possible partial descriptor at the tail is data
+        keep = descriptor_len + 3
+        if idx >= 0:
+            keep = max(keep, len(self._buffer) - idx)
+        flush = len(self._buffer) - keep
+        if flush > 0:
+            await self._write(bytes(self._buffer[:flush]))
+            del self._buffer[:flush]
+        return False
+
+    def _read_descriptor(self):
+        entry = self._entry
+        size_len = 8 if entry['zip64'] else 4
+        if len(self._buffer) < 4:
+            return None
+        offset = 4 if bytes(self._buffer[:4]) == DATA_DESCRIPTOR_SIG else 0
+        needed = offset + 4 + size_len * 2
+        if len(self._buffer) < needed:
+            return None
+        fmt = '<I' + ('QQ' if size_len == 8 else 'II')
+        crc, _, file_size = struct.unpack(fmt, self._buffer[offset:needed])
+        del self._buffer[:needed]
+        return crc, file_size
+
+    async def _finish_entry(self):
+        entry = self._entry
+        if entry['has_descriptor']:
+            descriptor = self._read_descriptor()
+            if descriptor is None:
+                return False
+            entry['crc'], entry['file_size'] = descriptor
+
+        await self._close_file()
+
+        if entry['running_crc'] != entry['crc'] or entry['written'] != entry['file_size']:
+            raise ZipStreamError(f"Bad CRC or size for ZIP entry {entry['name']}")
+
+        self._entry = None
+        if entry['path']:
+            self.completed_names.add(entry['name'])
+            self.checksums[entry['path']] = (entry['crc'], entry['written'])
+            EXTRACT_BYTES.inc(entry['written'], mode="stream")
+            EXTRACT_FILES.inc(mode="stream")
+            self.extracted_size += entry['written']
+            if self.file_callback:
+                await self.file_callback(entry['path'])
+        return True
+
+    async def _close_file(self):
+        if self._file:
+            await self._file.close()
+            self._file = None